@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark for YOLO output decoding
+Compares the original per-row Python loop with ObjectDetection.decode_outputs
+on raw network outputs recorded from a video (or synthetic outputs when no
+recording is available)
+
+  python3 benchmark_decode.py --record a.mp4 --frames 20   # record raw outputs
+  python3 benchmark_decode.py --outputs raw_outputs.npz    # benchmark them
+"""
+import argparse
+import time
+
+import cv2
+import numpy as np
+from object_detection import ObjectDetection
+
+
+def decode_loop(outs, width, height, conf_threshold):
+    """Reference decoder: the per-row loop ObjectDetection.detect used before"""
+    class_ids = []
+    scores = []
+    boxes = []
+
+    for out in outs:
+        for detection in out:
+            scores_list = detection[5:]
+            class_id = np.argmax(scores_list)
+            confidence = scores_list[class_id]
+
+            if confidence > conf_threshold:
+                center_x = int(detection[0] * width)
+                center_y = int(detection[1] * height)
+                w = int(detection[2] * width)
+                h = int(detection[3] * height)
+
+                x = center_x - w // 2
+                y = center_y - h // 2
+
+                boxes.append([x, y, w, h])
+                scores.append(float(confidence))
+                class_ids.append(class_id)
+
+    return (class_ids, scores, boxes)
+
+
+def record_outputs(od, video_path, n_frames, path):
+    cap = cv2.VideoCapture(video_path)
+    arrays = {}
+    n = 0
+    while n < n_frames:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        for j, out in enumerate(od.forward(frame)):
+            arrays[f"frame{n}_out{j}"] = out
+        arrays["width"], arrays["height"] = frame.shape[1], frame.shape[0]
+        n += 1
+    cap.release()
+    np.savez_compressed(path, **arrays)
+    print(f"Recorded raw outputs of {n} frames to {path}")
+
+
+def load_outputs(path):
+    data = np.load(path)
+    frames = {}
+    for key in data.files:
+        if not key.startswith("frame"):
+            continue
+        frame_key, out_key = key.split("_")
+        frames.setdefault(int(frame_key[5:]), {})[int(out_key[3:])] = data[key]
+    outs = [[layers[j] for j in sorted(layers)] for _, layers in sorted(frames.items())]
+    return outs, int(data["width"]), int(data["height"])
+
+
+def synthetic_outputs(image_size, n_frames, n_classes=80, seed=0):
+    """YOLOv4-shaped outputs (3 heads, 3 anchors each) with sparse confident rows"""
+    rng = np.random.default_rng(seed)
+    frames = []
+    for _ in range(n_frames):
+        outs = []
+        for stride in (8, 16, 32):
+            rows = (image_size // stride) ** 2 * 3
+            out = rng.random((rows, 5 + n_classes), dtype=np.float32) * 0.05
+            out[:, :4] = rng.random((rows, 4), dtype=np.float32)
+            hot = rng.choice(rows, size=max(1, rows // 500), replace=False)
+            out[hot, 5 + rng.integers(0, n_classes, size=len(hot))] = rng.uniform(0.3, 1.0, size=len(hot))
+            outs.append(out)
+        frames.append(outs)
+    return frames, 1280, 720
+
+
+def time_decoder(decoder, frames, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for outs in frames:
+            decoder(outs)
+        best = min(best, time.perf_counter() - start)
+    return best / len(frames) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--outputs", help="npz file with recorded raw outputs")
+    parser.add_argument("--record", metavar="VIDEO", help="record raw outputs from this video first")
+    parser.add_argument("--frames", type=int, default=20)
+    parser.add_argument("--image-size", type=int, default=832)
+    parser.add_argument("--conf", type=float, default=0.3)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--weights", default="yolov4.weights")
+    parser.add_argument("--config", default="yolov4.cfg")
+    args = parser.parse_args()
+
+    od = ObjectDetection(args.weights, args.config)
+    od.confThreshold = args.conf
+
+    if args.record:
+        od.load_detection_model(image_size=args.image_size, confThreshold=args.conf)
+        args.outputs = args.outputs or "raw_outputs.npz"
+        record_outputs(od, args.record, args.frames, args.outputs)
+
+    if args.outputs:
+        frames, width, height = load_outputs(args.outputs)
+        source = args.outputs
+    else:
+        frames, width, height = synthetic_outputs(args.image_size, args.frames)
+        source = f"synthetic YOLOv4 outputs at image_size={args.image_size}"
+
+    # Both decoders must agree exactly before timing means anything
+    for outs in frames:
+        expected = decode_loop(outs, width, height, args.conf)
+        actual = od.decode_outputs(outs, width, height)
+        assert [int(c) for c in expected[0]] == actual[0], "class_ids differ"
+        assert expected[1] == actual[1], "scores differ"
+        assert expected[2] == actual[2], "boxes differ"
+
+    rows = sum(len(out) for out in frames[0])
+    loop_ms = time_decoder(lambda outs: decode_loop(outs, width, height, args.conf), frames, args.repeat)
+    vec_ms = time_decoder(lambda outs: od.decode_outputs(outs, width, height), frames, args.repeat)
+
+    print(f"Source: {source} ({len(frames)} frames, {rows} rows/frame)")
+    print("Outputs identical: yes")
+    print(f"  Python loop : {loop_ms:8.2f} ms/frame")
+    print(f"  Vectorized  : {vec_ms:8.2f} ms/frame")
+    print(f"  Speed-up    : {loop_ms / vec_ms:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+import csv
+import datetime
+import io
+import json
+import queue
+import threading
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import OperationalError
+
+# Used when the configured database cannot be reached, e.g. when testing without PostgreSQL
+SQLITE_FALLBACK = "sqlite:///speed_records.db"
+
+_END = object()
+
+
+def _is_dbapi_error(error, name):
+    """
+    True if error is, or wraps, a PEP 249 exception class called name (e.g. "IntegrityError")
+    Matched by name so psycopg2/sqlite3 errors and SQLAlchemy's wrappers of them all count
+    """
+    errors = [error, getattr(error, "orig", None)]
+    return any(cls.__name__ == name for e in errors if e is not None for cls in type(e).__mro__)
+
+
+def connect(url, fallback=SQLITE_FALLBACK):
+    """One pooled engine for url, or for the SQLite fallback if url cannot be reached"""
+    if fallback is None:
+        return create_engine(url, pool_pre_ping=True)
+    try:
+        engine = create_engine(url, pool_pre_ping=True)
+        with engine.connect():
+            pass
+    except (OperationalError, ImportError) as e:
+        # ImportError: the database driver (e.g. psycopg2) is not installed
+        print(f"Database {make_url(url).render_as_string(hide_password=True)} unavailable "
+              f"({type(e).__name__}), writing to {fallback}")
+        engine = create_engine(fallback)
+    return engine
+
+
+class DBWriter:
+    """
+    Writes records (dicts of column -> value) into one table from a background thread
+    Records are batched by size (batch_size) or age (flush_interval seconds) and
+    written with a single bulk INSERT, or COPY on PostgreSQL. The queue is bounded:
+    put() blocks when the database falls behind (block=True) or drops and counts
+    the record (block=False). close() writes everything still queued
+    """
+    def __init__(self, engine, table, batch_size=500, flush_interval=1.0, max_queue=10000, block=True):
+        self.engine = engine
+        self.table = table
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.block = block
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.use_copy = engine.dialect.name == "postgresql" and engine.dialect.driver == "psycopg2"
+
+        self.written = 0
+        self.batches = 0
+        self.dropped = 0
+        self.failed = 0
+        self.write_time = 0.0
+
+        self.thread = threading.Thread(target=self._run, name=f"db-writer-{table.name}", daemon=True)
+        self.thread.start()
+
+    def put(self, record):
+        """Queue one record; returns False if it was dropped because the queue is full"""
+        try:
+            self.queue.put(record, block=self.block)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def close(self, timeout=None):
+        """Flush every queued record and stop the writer thread"""
+        self.queue.put(_END)
+        self.thread.join(timeout)
+        if self.thread.is_alive():
+            # Still writing: disposing the engine now would pull its connections away
+            print(f"DB writer for {self.table.name} still busy after {timeout}s, "
+                  f"{self.queue.qsize()} records queued")
+            return
+        self.engine.dispose()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _run(self):
+        batch = []
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                record = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                record = None
+
+            if record is _END:
+                self._write(batch)
+                return
+            if record is not None:
+                batch.append(record)
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+
+            if len(batch) >= self.batch_size or (batch and time.monotonic() >= deadline):
+                self._write(batch)
+                batch = []
+                deadline = None
+
+    def _write(self, batch):
+        if not batch:
+            return
+        start = time.perf_counter()
+        try:
+            self._write_batch(batch)
+            self.written += len(batch)
+            self.batches += 1
+        except Exception as e:
+            if _is_dbapi_error(e, "IntegrityError") or _is_dbapi_error(e, "DataError"):
+                # Some rows are bad (e.g. a duplicate key): write row by row so only those are lost
+                self._write_rows(batch)
+            else:
+                # Never let one bad batch stop the writer; the video loop keeps going
+                self.failed += len(batch)
+                print(f"Writing {len(batch)} records to {self.table.name} failed: {type(e).__name__}: {e}")
+        self.write_time += time.perf_counter() - start
+
+    def _write_batch(self, batch):
+        if self.use_copy:
+            try:
+                self._copy(batch)
+                return
+            except Exception as e:
+                # Only a driver without COPY support switches to INSERT for good; data errors are the batch's
+                if not (isinstance(e, (AttributeError, NotImplementedError))
+                        or _is_dbapi_error(e, "NotSupportedError")):
+                    raise
+                print(f"COPY into {self.table.name} is not supported ({type(e).__name__}: {e}), using INSERT")
+                self.use_copy = False
+        self._insert(batch)
+
+    def _write_rows(self, batch):
+        failed = 0
+        for record in batch:
+            try:
+                self._insert([record])
+                self.written += 1
+            except Exception as e:
+                failed += 1
+                error = e
+        self.batches += 1
+        self.failed += failed
+        if failed:
+            print(f"{failed} of {len(batch)} records rejected by {self.table.name}, "
+                  f"last error: {type(error).__name__}: {str(error).splitlines()[0]}")
+
+    def _insert(self, batch):
+        # One executemany for the whole batch inside one transaction
+        with self.engine.begin() as conn:
+            conn.execute(self.table.insert(), batch)
+
+    def _copy(self, batch):
+        columns = [column.name for column in self.table.columns if column.name in batch[0]]
+        column_list = ", ".join(f'"{name}"' for name in columns)
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for record in batch:
+            writer.writerow([self._copy_value(record.get(name)) for name in columns])
+        buffer.seek(0)
+
+        conn = self.engine.raw_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.copy_expert(f'COPY "{self.table.name}" ({column_list}) FROM STDIN WITH (FORMAT csv)',
+                                   buffer)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _copy_value(value):
+        # Unquoted empty field is NULL in COPY ... CSV
+        if value is None:
+            return ""
+        if isinstance(value, (dict, list)):
+            return json.dumps(value)
+        if isinstance(value, (datetime.datetime, datetime.date)):
+            return value.isoformat()
+        return value
+
+    def stats(self):
+        return {"written": self.written, "batches": self.batches, "dropped": self.dropped,
+                "failed": self.failed, "queued": self.queue.qsize(), "write_ms": self.write_time * 1000}
+
+    def report(self):
+        return (f"db: {self.written} records in {self.batches} batches ({self.write_time * 1000:.0f} ms)"
+                f" | queued: {self.queue.qsize()} | dropped: {self.dropped} | failed: {self.failed}")
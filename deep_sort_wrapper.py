@@ -1,52 +1,274 @@
+import time
+from collections import Counter, OrderedDict, deque
+
+import cv2
 import numpy as np
 from deep_sort.deep_sort import tracker as tracker_module
 from deep_sort.deep_sort import nn_matching
 from deep_sort.deep_sort import detection as detection_module
+from deep_sort.deep_sort import linear_assignment
+
+class Tracker(tracker_module.Tracker):
+    """deep_sort Tracker that remembers which track each detection was matched to"""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.last_matches = []  # (track, detection index) pairs of the last update
+        self.last_initiated = []  # (track, detection) pairs started in the last update
+
+    def _match(self, detections):
+        matches, unmatched_tracks, unmatched_detections = super()._match(detections)
+        # Keep the Track objects: indices shift once deleted tracks are dropped
+        self.last_matches = [(self.tracks[track_idx], detection_idx) for track_idx, detection_idx in matches]
+        self.last_initiated = []
+        return matches, unmatched_tracks, unmatched_detections
+
+    def _initiate_track(self, detection):
+        super()._initiate_track(detection)
+        self.last_initiated.append((self.tracks[-1], detection))
+
+
+def iou_cost(tracks, detections, track_indices=None, detection_indices=None):
+    """
+    1 - IoU between the Kalman-predicted box of every track and every detection
+    Same contract as deep_sort's iou_matching.iou_cost, including INFTY_COST rows for
+    tracks missed for more than one frame, but the whole matrix is computed in one
+    array operation instead of one row per track
+    """
+    if track_indices is None:
+        track_indices = np.arange(len(tracks))
+    if detection_indices is None:
+        detection_indices = np.arange(len(detections))
+    if len(track_indices) == 0 or len(detection_indices) == 0:
+        return np.zeros((len(track_indices), len(detection_indices)))
+
+    # Track boxes straight from the (x, y, a, h) means, as [x1, y1, x2, y2]
+    xyah = np.array([tracks[i].mean[:4] for i in track_indices])
+    w = xyah[:, 2] * xyah[:, 3]
+    track_boxes = np.stack([xyah[:, 0] - w / 2, xyah[:, 1] - xyah[:, 3] / 2,
+                            xyah[:, 0] + w / 2, xyah[:, 1] + xyah[:, 3] / 2], axis=1)
+    tlwh = np.array([detections[i].tlwh for i in detection_indices], dtype=np.float64)
+    detection_boxes = np.concatenate([tlwh[:, :2], tlwh[:, :2] + tlwh[:, 2:]], axis=1)
+
+    top_left = np.maximum(track_boxes[:, None, :2], detection_boxes[None, :, :2])
+    bottom_right = np.minimum(track_boxes[:, None, 2:], detection_boxes[None, :, 2:])
+    inter = np.prod(np.clip(bottom_right - top_left, 0, None), axis=2)
+    union = (w * xyah[:, 3])[:, None] + (tlwh[:, 2] * tlwh[:, 3])[None, :] - inter
+    cost = 1.0 - inter / np.maximum(union, 1e-9)
+    # Tracks lost for several frames must not win matches on a stale predicted box
+    time_since_update = np.array([tracks[i].time_since_update for i in track_indices])
+    cost[time_since_update > 1] = linear_assignment.INFTY_COST
+    return cost
+
+
+class MotionTracker(Tracker):
+    """
+    Motion-only deep_sort: Kalman prediction + IoU matching, no appearance features
+    Every track (confirmed or not) is matched by IoU against its predicted box,
+    as in SORT, and the cosine metric is never fitted, so detections may carry
+    feature=None
+    """
+    def _match(self, detections):
+        matches, unmatched_tracks, unmatched_detections = linear_assignment.min_cost_matching(
+            iou_cost, self.max_iou_distance, self.tracks, detections)
+        self.last_matches = [(self.tracks[track_idx], detection_idx) for track_idx, detection_idx in matches]
+        self.last_initiated = []
+        return matches, unmatched_tracks, unmatched_detections
+
+    def update(self, detections):
+        matches, unmatched_tracks, unmatched_detections = self._match(detections)
+        for track_idx, detection_idx in matches:
+            self.tracks[track_idx].update(self.kf, detections[detection_idx])
+        for track_idx in unmatched_tracks:
+            self.tracks[track_idx].mark_missed()
+        for detection_idx in unmatched_detections:
+            self._initiate_track(detections[detection_idx])
+        self.tracks = [track for track in self.tracks if not track.is_deleted()]
+        # Track.update still appends detection.feature; nothing consumes it here
+        for track in self.tracks:
+            track.features = []
+
+
+class FeatureCache:
+    """
+    Last appearance feature of each confirmed track, so stable tracks are not re-encoded
+    A detection reuses a cached feature when it overlaps the track's predicted
+    box with IoU >= min_iou, as long as that feature is less than
+    refresh_every frames old. Bounded to max_size tracks (least recently
+    updated first out) and evicted on track deletion.
+    """
+    def __init__(self, max_size=256, min_iou=0.7, refresh_every=10):
+        self.max_size = max_size
+        self.min_iou = min_iou
+        self.refresh_every = refresh_every
+        self.entries = OrderedDict()  # track_id -> [feature, age in frames]
+        self.reused = {}  # detection index -> age of the feature it reused, for the last frame
+        self.hits = 0
+        self.misses = 0
+        self.encode_time = 0.0
+
+    def lookup(self, tracks, boxes, predicted):
+        """Cached feature (or None) for each [x, y, w, h] box"""
+        self.reused = {}
+        cached = [None] * len(boxes)
+        # Only tracks matched in the last update have a fresh Kalman state to predict from
+        since_update = 1 if predicted else 0
+        candidates = [track for track in tracks
+                      if track.track_id in self.entries and track.time_since_update == since_update
+                      and self.entries[track.track_id][1] + 1 < self.refresh_every]
+        if not candidates or not len(boxes):
+            self.misses += len(boxes)
+            return cached
+
+        # Predicted [x1, y1, x2, y2] of each candidate from its (x, y, a, h) Kalman mean
+        means = np.array([track.mean for track in candidates])
+        xyah = means[:, :4] if predicted else means[:, :4] + means[:, 4:]
+        w = xyah[:, 2] * xyah[:, 3]
+        predicted_boxes = np.stack([xyah[:, 0] - w / 2, xyah[:, 1] - xyah[:, 3] / 2,
+                                    xyah[:, 0] + w / 2, xyah[:, 1] + xyah[:, 3] / 2], axis=1)
+
+        boxes = np.asarray(boxes, dtype=np.float64)
+        detection_boxes = np.concatenate([boxes[:, :2], boxes[:, :2] + boxes[:, 2:4]], axis=1)
+        top_left = np.maximum(detection_boxes[:, None, :2], predicted_boxes[None, :, :2])
+        bottom_right = np.minimum(detection_boxes[:, None, 2:], predicted_boxes[None, :, 2:])
+        inter = np.prod(np.clip(bottom_right - top_left, 0, None), axis=2)
+        area_d = boxes[:, 2] * boxes[:, 3]
+        area_p = w * xyah[:, 3]
+        iou = inter / np.maximum(area_d[:, None] + area_p[None, :] - inter, 1e-9)
+
+        # A track's feature goes to at most one detection, and only if it is that detection's best match
+        used = set()
+        for detection_idx in np.argsort(-iou.max(axis=1)):
+            best = int(np.argmax(iou[detection_idx]))
+            if iou[detection_idx, best] < self.min_iou or best in used:
+                continue
+            used.add(best)
+            feature, age = self.entries[candidates[best].track_id]
+            cached[detection_idx] = feature
+            self.reused[int(detection_idx)] = age + 1
+
+        self.hits += len(self.reused)
+        self.misses += len(boxes) - len(self.reused)
+        return cached
+
+    def store(self, track_id, feature, detection_idx):
+        """Remember the feature of the detection matched to a confirmed track"""
+        self.entries[track_id] = [feature, self.reused.get(detection_idx, 0)]
+        self.entries.move_to_end(track_id)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def evict(self, track_id):
+        self.entries.pop(track_id, None)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        per_encode = self.encode_time / self.misses if self.misses else 0.0
+        return {"hit_rate": self.hits / lookups if lookups else 0.0,
+                "hits": self.hits,
+                "misses": self.misses,
+                "encode_ms": self.encode_time * 1000,
+                "saved_ms": self.hits * per_encode * 1000}
+
+    def report(self):
+        stats = self.stats()
+        return (f"feature cache hit rate: {stats['hit_rate']:.1%} | encoder time: {stats['encode_ms']:.0f}ms"
+                f" | saved: ~{stats['saved_ms']:.0f}ms")
+
 
 class TrackerWrapper:
     """Wrapper around deep_sort Tracker to provide compatible interface"""
-    def __init__(self, tracker):
+    def __init__(self, tracker, feature_cache=None, class_window=10):
         self.tracker = tracker
-        self.last_class_ids = {}  # Store class_id for each track_id
+        self.feature_cache = feature_cache
+        self.predicted = False  # predict() already ran for the coming update
+        self.class_window = class_window
+        self.class_votes = {}  # track_id -> class ids of its last class_window matched detections
+        self.last_class_ids = {}  # Store class_id for each track_id (majority of its votes)
+        self.deleted_ids = set()  # Track ids deep_sort deleted in the last update
 
     def predict(self):
         self.tracker.predict()
+        self.predicted = True
 
     def update(self, detections):
         """Update tracker and return results in compatible format"""
+        class_ids, object_ids, boxes = self.update_arrays(detections)
+        return (class_ids.tolist(), object_ids.tolist(), boxes.tolist())
+
+    def update_arrays(self, detections):
+        """Same as update(), but returns class_ids (N), object_ids (N) and [x1, y1, x2, y2] boxes (N x 4) as arrays"""
+        previous_ids = {track.track_id for track in self.tracker.tracks}
         self.tracker.update(detections)
+        self.predicted = False
+        self.deleted_ids = previous_ids - {track.track_id for track in self.tracker.tracks}
 
-        # Extract confirmed tracks
-        class_ids = []
-        object_ids = []
-        boxes = []
+        for track_id in self.deleted_ids:
+            self.class_votes.pop(track_id, None)
+            self.last_class_ids.pop(track_id, None)
 
-        for track in self.tracker.tracks:
-            if not track.is_confirmed():
-                continue
+        # Each track takes the class of the detections it was matched to, by majority vote
+        matched = [(track, detections[detection_idx]) for track, detection_idx in self.tracker.last_matches]
+        for track, detection in matched + self.tracker.last_initiated:
+            class_id = getattr(detection, "class_id", None)
+            if class_id is not None:
+                self.vote_class(track.track_id, class_id)
 
-            # Get bounding box in [x1, y1, x2, y2] format
-            tlwh = track.to_tlwh()
-            x, y, w, h = tlwh
-            x2 = x + w
-            y2 = y + h
+        if self.feature_cache is not None:
+            for track_id in self.deleted_ids:
+                self.feature_cache.evict(track_id)
+            for track, detection_idx in self.tracker.last_matches:
+                if track.is_confirmed() and not track.is_deleted():
+                    self.feature_cache.store(track.track_id, detections[detection_idx].feature, detection_idx)
 
-            boxes.append([int(x), int(y), int(x2), int(y2)])
-            object_ids.append(track.track_id)
+        return self.confirmed_arrays()
 
-            # Use stored class_id or default to 0
-            class_id = self.last_class_ids.get(track.track_id, 0)
-            class_ids.append(class_id)
+    def confirmed_arrays(self):
+        """Confirmed tracks as arrays; boxes come from all Kalman means at once instead of to_tlwh() per track"""
+        tracks = [track for track in self.tracker.tracks if track.is_confirmed()]
+        object_ids = np.array([track.track_id for track in tracks], dtype=np.int64)
+        # Use stored class_id or default to 0
+        class_ids = np.array([self.last_class_ids.get(track.track_id, 0) for track in tracks], dtype=np.int64)
+        if not tracks:
+            return class_ids, object_ids, np.zeros((0, 4), dtype=np.int64)
 
-        return (class_ids, object_ids, boxes)
+        xyah = np.array([track.mean[:4] for track in tracks])
+        w = xyah[:, 2] * xyah[:, 3]
+        x = xyah[:, 0] - w / 2
+        y = xyah[:, 1] - xyah[:, 3] / 2
+        # astype truncates toward zero exactly like the int() used before
+        boxes = np.stack([x, y, x + w, y + xyah[:, 3]], axis=1).astype(np.int64)
+        return class_ids, object_ids, boxes
 
     def store_class_ids(self, object_ids, class_ids):
-        """Store class_ids for tracks"""
+        """Store class_ids for tracks (one vote each)"""
         for obj_id, class_id in zip(object_ids, class_ids):
-            self.last_class_ids[obj_id] = class_id
+            self.vote_class(obj_id, class_id)
+
+    def vote_class(self, track_id, class_id):
+        """A track's class is the most frequent of its last class_window votes; ties go to the most recent"""
+        votes = self.class_votes.get(track_id)
+        if votes is None:
+            votes = self.class_votes[track_id] = deque(maxlen=self.class_window)
+        votes.append(class_id)
+        counts = Counter(votes)
+        self.last_class_ids[track_id] = max(reversed(votes), key=counts.__getitem__)
+
+    def evict(self, track_id):
+        """Forget everything stored for a finished track"""
+        self.class_votes.pop(track_id, None)
+        self.last_class_ids.pop(track_id, None)
+        if self.feature_cache is not None:
+            self.feature_cache.evict(track_id)
 
 class Deep:
-    def __init__(self, max_distance=0.7, nms_max_overlap=1, n_init=3, max_age=15, max_iou_distance=0.7):
+    # Crop size fed to the appearance encoder (width, height); people/bikes are taller than wide
+    CROP_SIZE = (32, 64)
+    # HSV bins per half crop: 8 hue x 4 saturation x 2 value = 64, two halves = 128-d feature
+    HSV_BINS = (8, 4, 2)
+
+    def __init__(self, max_distance=0.7, nms_max_overlap=1, n_init=3, max_age=15, max_iou_distance=0.7,
+                 encoder_model=None, encoder_size=(64, 128), cache_size=256, cache_iou=0.7, cache_refresh=10,
+                 motion_only=False, class_window=10):
         self.max_distance = max_distance
         self.nms_max_overlap = nms_max_overlap
         self.n_init = n_init
@@ -55,6 +277,22 @@ class Deep:
         self.tracker = None
         self.metric = None
         self.wrapper = None
+        # Kalman + IoU only: no appearance features are extracted or matched
+        self.motion_only = motion_only
+        # Number of recent matched detections whose majority decides a track's class
+        self.class_window = class_window
+        # Per-track feature cache, created with each tracker; cache_size=0 encodes every box every frame
+        self.cache_params = (cache_size, cache_iou, cache_refresh)
+        self.feature_cache = None
+
+        # Optional ONNX re-id network (e.g. a small OSNet/mars model); the colour
+        # descriptor below is used when no model is given
+        self.encoder_net = None
+        self.encoder_size = encoder_size
+        if encoder_model is not None:
+            self.encoder_net = cv2.dnn.readNet(encoder_model)
+            self.encoder_net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+            self.encoder_net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
 
     def sort_tracker(self):
         # Create distance metric
@@ -62,41 +300,120 @@ class Deep:
             "cosine", self.max_distance, None
         )
         # Create tracker
-        base_tracker = tracker_module.Tracker(
+        tracker_class = MotionTracker if self.motion_only else Tracker
+        base_tracker = tracker_class(
             self.metric,
             max_iou_distance=self.max_iou_distance,
             max_age=self.max_age,
             n_init=self.n_init
         )
-        self.wrapper = TrackerWrapper(base_tracker)
+        use_cache = self.cache_params[0] > 0 and not self.motion_only
+        self.feature_cache = FeatureCache(*self.cache_params) if use_cache else None
+        self.wrapper = TrackerWrapper(base_tracker, self.feature_cache, self.class_window)
         self.tracker = self.wrapper
         return self.tracker
 
+    def report(self):
+        """Feature cache report, also when the cache is off (cache_size=0 or motion_only)"""
+        if self.feature_cache is None:
+            return "feature cache: off"
+        return self.feature_cache.report()
+
+    def crops(self, frame, boxes, size):
+        """Cut every [x, y, w, h] box out of the frame, clipped to the image and resized to `size`"""
+        height, width = frame.shape[:2]
+        batch = np.zeros((len(boxes), size[1], size[0], 3), dtype=np.uint8)
+        valid = np.zeros(len(boxes), dtype=bool)
+        for i, (x, y, w, h) in enumerate(boxes):
+            x1, y1 = max(int(x), 0), max(int(y), 0)
+            x2, y2 = min(int(x + w), width), min(int(y + h), height)
+            if x2 - x1 < 2 or y2 - y1 < 2:
+                continue
+            cv2.resize(frame[y1:y2, x1:x2], size, dst=batch[i], interpolation=cv2.INTER_AREA)
+            valid[i] = True
+        return batch, valid
+
     def encoder(self, frame, boxes):
         """
-        Simple feature encoder - returns dummy features for now
-        In a real implementation, this would use a CNN to extract features
+        Appearance features for all boxes of a frame, one L2-normalised row per box
+        All crops are encoded as a single batch: one forward pass with the ONNX
+        model, or one HSV conversion and one histogram for the colour descriptor.
+        Returns None in motion-only mode without touching the frame
         """
-        features = []
-        for box in boxes:
-            # Create a dummy feature vector (128-dim)
-            feature = np.random.randn(128)
-            feature = feature / np.linalg.norm(feature)
-            features.append(feature)
-        return np.array(features)
+        if self.motion_only:
+            return None
+        if self.feature_cache is None or self.wrapper is None:
+            return self.encode(frame, boxes)
+
+        # Stable tracks reuse their cached feature; only the rest are cropped and encoded
+        cached = self.feature_cache.lookup(self.wrapper.tracker.tracks, boxes, self.wrapper.predicted)
+        missing = [i for i, feature in enumerate(cached) if feature is None]
+        start = time.perf_counter()
+        encoded = self.encode(frame, [boxes[i] for i in missing])
+        self.feature_cache.encode_time += time.perf_counter() - start
+        for i, feature in zip(missing, encoded):
+            cached[i] = feature
+        if not cached:
+            return encoded
+        return np.array(cached, dtype=np.float32)
+
+    def encode(self, frame, boxes):
+        if len(boxes) == 0:
+            return np.zeros((0, 128), dtype=np.float32)
+        if self.encoder_net is not None:
+            return self.encode_network(frame, boxes)
+        return self.encode_colour(frame, boxes)
+
+    def encode_network(self, frame, boxes):
+        batch, _ = self.crops(frame, boxes, self.encoder_size)
+        blob = cv2.dnn.blobFromImages(list(batch), 1 / 255.0, self.encoder_size, swapRB=True, crop=False)
+        self.encoder_net.setInput(blob)
+        features = self.encoder_net.forward().reshape(len(boxes), -1).astype(np.float32)
+        return features / np.maximum(np.linalg.norm(features, axis=1, keepdims=True), 1e-12)
+
+    def encode_colour(self, frame, boxes):
+        """Two-part (upper/lower half) HSV histogram; the rider and the bike are described separately"""
+        batch, valid = self.crops(frame, boxes, self.CROP_SIZE)
+        n = len(boxes)
+        w, h = self.CROP_SIZE
+
+        # Stack the crops vertically so the whole batch is converted in one call
+        hsv = cv2.cvtColor(batch.reshape(n * h, w, 3), cv2.COLOR_BGR2HSV).reshape(n, h, w, 3)
+        h_bins, s_bins, v_bins = self.HSV_BINS
+        hue = hsv[..., 0].astype(np.int32) * h_bins // 180
+        sat = hsv[..., 1].astype(np.int32) * s_bins // 256
+        val = hsv[..., 2].astype(np.int32) * v_bins // 256
+        bins = (hue * s_bins + sat) * v_bins + val
+
+        per_half = h_bins * s_bins * v_bins
+        half = (np.arange(h) >= h // 2).astype(np.int32)[None, :, None] * per_half
+        offsets = (np.arange(n, dtype=np.int32) * 2 * per_half)[:, None, None]
+        counts = np.bincount((bins + half + offsets).ravel(), minlength=n * 2 * per_half)
+        features = counts.reshape(n, 2 * per_half).astype(np.float32)
+
+        # Hellinger (square root) weighting keeps a single dominant colour from swamping the rest
+        features = np.sqrt(features)
+        features /= np.maximum(np.linalg.norm(features, axis=1, keepdims=True), 1e-12)
+        # Boxes with nothing to crop get a neutral, uninformative feature
+        features[~valid] = 1 / np.sqrt(2 * per_half)
+        return features
 
     def Detection(self, boxes, scores, class_ids, features):
         """
         Create Detection objects for the tracker
+        Takes lists or arrays: boxes (N x 4, [x, y, w, h]), scores (N), class_ids (N),
+        features (N x D, or None in motion-only mode). Boxes are converted once and
+        each Detection gets a row view instead of a freshly allocated array
         """
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        scores = np.asarray(scores, dtype=np.float64).tolist()
+        class_ids = np.asarray(class_ids, dtype=np.int64).tolist()
+        if features is None:
+            features = [None] * len(boxes)
         detections = []
         for box, score, class_id, feature in zip(boxes, scores, class_ids, features):
-            x, y, w, h = box
-            # Convert to [x1, y1, x2, y2] format
-            detection = detection_module.Detection(
-                tlwh=np.array([x, y, w, h]),
-                confidence=score,
-                feature=feature
-            )
+            detection = detection_module.Detection(tlwh=box, confidence=score, feature=feature)
+            # Carried through matching so the track can vote on its class
+            detection.class_id = class_id
             detections.append(detection)
         return detections
@@ -0,0 +1,52 @@
+import cv2
+import numpy as np
+
+class FrameMask:
+    """
+    Mask applied to every frame of a stream
+    The mask is resized and binarized once per stream resolution, and frames are
+    masked into preallocated buffers so steady-state processing allocates nothing
+    """
+    def __init__(self, mask, buffers=1):
+        self.mask = mask
+        self.buffers = buffers
+        self.size = None
+        self.binary = None
+        self.all_white = mask is None
+        self._outputs = []
+        self._next = 0
+
+    def prepare(self, width, height):
+        """Resize and binarize the mask for a stream resolution (cached)"""
+        if self.mask is None or self.size == (width, height):
+            return
+
+        resized = cv2.resize(self.mask, (width, height))
+        if resized.ndim == 3:
+            resized = cv2.cvtColor(resized, cv2.COLOR_BGR2GRAY)
+        _, binary = cv2.threshold(resized, 127, 255, cv2.THRESH_BINARY)
+
+        self.size = (width, height)
+        self.binary = cv2.cvtColor(binary, cv2.COLOR_GRAY2BGR)
+        self.all_white = bool(binary.all())
+        self._outputs = [np.zeros((height, width, 3), dtype=np.uint8) for _ in range(self.buffers)]
+        self._next = 0
+
+    def apply(self, frame):
+        """
+        Return the masked frame
+        The result lives in one of `buffers` reused arrays (round robin), so keep at
+        most `buffers` results alive at a time. An all-white mask returns the frame itself
+        """
+        if self.mask is None:
+            return frame
+
+        height, width = frame.shape[:2]
+        self.prepare(width, height)
+        if self.all_white:
+            return frame
+
+        out = self._outputs[self._next]
+        self._next = (self._next + 1) % len(self._outputs)
+        cv2.bitwise_and(frame, self.binary, dst=out)
+        return out
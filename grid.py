@@ -1,7 +1,17 @@
+import datetime
+import logging
 import math
 
+import numpy as np
+
+# Thông báo theo từng xe (vào grid, vận tốc) ở mức DEBUG: bản ghi đã được ghi qua sinks,
+# bật bằng logging.basicConfig(level=logging.DEBUG) khi cần theo dõi
+logger = logging.getLogger(__name__)
+
 
 class Object:
+    __slots__ = ('id', 'x', 'y')
+
     def __init__(self, id, x, y):
         self.id = id
         self.x = x
@@ -32,15 +42,92 @@ class CheckTool:
     def distance(x1, y1, x2, y2):
         return math.sqrt((x2 - x1) ** 2 + (y2 - y1) ** 2)
 
+class ObjectStore:
+    """ Bảng dạng cột lưu trạng thái (grid, id xe) cho mọi grid của một lưới, thay cho list trong dict của từng grid
+        Mỗi dòng gồm: frame (int32), tọa độ tâm x, y (int32), vận tốc tức thời, vận tốc không gian (float64, NaN = chưa có), làn (int8)
+        Thời gian không lưu dưới dạng datetime mà tính lại từ frame khi cần
+        Dòng bị xóa sẽ được dùng lại nên bộ nhớ chỉ phụ thuộc số cặp (grid, id) đang được lưu"""
+    __slots__ = ('frame', 'x', 'y', 'instant', 'spatial', 'lane', 'free', 'size')
+    COLUMNS = ('frame', 'x', 'y', 'instant', 'spatial', 'lane')
+    LANES = (None, 'On', 'Under')
+
+    def __init__(self, capacity=256):
+        self.frame = np.zeros(capacity, dtype=np.int32)
+        self.x = np.zeros(capacity, dtype=np.int32)
+        self.y = np.zeros(capacity, dtype=np.int32)
+        self.instant = np.full(capacity, np.nan)
+        self.spatial = np.full(capacity, np.nan)
+        self.lane = np.zeros(capacity, dtype=np.int8)
+        self.free = []
+        self.size = 0
+
+    """ Cấp một dòng mới (hoặc dòng đã xóa trước đó) """
+    def allocate(self):
+        if self.free:
+            return self.free.pop()
+        if self.size == len(self.frame):
+            for name in self.COLUMNS:
+                column = getattr(self, name)
+                extra = np.full(len(column), np.nan) if column.dtype.kind == 'f' else np.zeros(len(column), dtype=column.dtype)
+                setattr(self, name, np.concatenate([column, extra]))
+        self.size += 1
+        return self.size - 1
+
+    """ Ghi lại frame và tọa độ, xóa vận tốc và làn cũ của dòng """
+    def reset(self, row, frame, x, y):
+        self.frame[row] = frame
+        self.x[row] = x
+        self.y[row] = y
+        self.instant[row] = np.nan
+        self.spatial[row] = np.nan
+        self.lane[row] = 0
+
+    def release(self, row):
+        self.free.append(row)
+
+    """ Đọc nhiều dòng cùng lúc, mỗi dòng là [frame, [x, y], vận tốc tức thời, vận tốc không gian, làn] """
+    def get_many(self, rows):
+        instant = self.instant[rows]
+        spatial = self.spatial[rows]
+        instant = np.where(np.isnan(instant), None, instant).tolist()
+        spatial = np.where(np.isnan(spatial), None, spatial).tolist()
+        lanes = [self.LANES[lane] for lane in self.lane[rows].tolist()]
+        coords = [list(xy) for xy in zip(self.x[rows].tolist(), self.y[rows].tolist())]
+        return [list(row) for row in zip(self.frame[rows].tolist(), coords, instant, spatial, lanes)]
+
+    """ Số dòng đang được sử dụng """
+    def __len__(self):
+        return self.size - len(self.free)
+
+    """ Dung lượng bộ nhớ của các cột (byte) """
+    def nbytes(self):
+        return sum(getattr(self, name).nbytes for name in self.COLUMNS)
+
+    """ Đọc một dòng dưới dạng (frame, [x, y], vận tốc tức thời, vận tốc không gian, làn) """
+    def get(self, row):
+        instant = float(self.instant[row])
+        spatial = float(self.spatial[row])
+        return (int(self.frame[row]), [int(self.x[row]), int(self.y[row])],
+                None if math.isnan(instant) else instant,
+                None if math.isnan(spatial) else spatial,
+                self.LANES[self.lane[row]])
+
+
 class RectangularArea:
-    def __init__(self, idx1, idx2, x1, y1, x2, y2):
+    __slots__ = ('left', 'top', 'right', 'bottom', 'index', 'index_name', 'objects', 'store',
+                 'neighbours', 'layout', 'x1', 'x2', 'y1', 'y2')
+
+    def __init__(self, idx1, idx2, x1, y1, x2, y2, store=None):
         self.left = min(x1, x2)
         self.top = min(y1, y2)
         self.right = max(x1, x2)
         self.bottom = max(y1, y2)
         self.index = (idx1, idx2)
         self.index_name = "grid_{}_{}" .format(idx1, idx2)
-        self.objects = {}
+        self.objects = {} # id xe -> dòng trong self.store
+        self.store = store if store is not None else ObjectStore(16)
+        self.neighbours = None
+        self.layout = None # GridLayout chứa grid này (nếu có), được báo mỗi khi thêm / xóa đối tượng
         self.x1 = x1
         self.x2 = x2
         self.y1 = y1
@@ -51,18 +138,37 @@ class RectangularArea:
         return self.left <= x <= self.right and self.top <= y <= self.bottom
 
     """ thêm đối tượng và thông tin vào grid """
-    def add_object(self, obj_id, frame, datetime, coords):
-        self.objects[obj_id] = [frame, datetime, coords, None, None, None]
+    def add_object(self, obj_id, frame, coords):
+        row = self.objects.get(obj_id)
+        is_new = row is None
+        if is_new:
+            row = self.store.allocate()
+            self.objects[obj_id] = row
+        self.store.reset(row, frame, coords[0], coords[1])
+        if is_new and self.layout is not None:
+            self.layout.object_added(self, obj_id)
 
     """ loại bỏ id đối tượng ra khỏi grid (id này có trong class) """
     def remove_object(self, obj_id):
         if obj_id in self.objects:
-            del self.objects[obj_id]
+            self.store.release(self.objects.pop(obj_id))
+            if self.layout is not None:
+                self.layout.object_removed(self, obj_id)
 
     """ kiểm tra object id này có từng trong grid không """
     def check_object(self, obj_id):
         return obj_id in self.objects
 
+    """ Lấy thông tin (frame, [x, y], vận tốc tức thời, vận tốc không gian, làn) của id trong grid """
+    def get_object(self, obj_id):
+        return self.store.get(self.objects[obj_id])
+
+    def get_instant_speed(self, obj_id):
+        return self.get_object(obj_id)[2]
+
+    def get_spatial_speed(self, obj_id):
+        return self.get_object(obj_id)[3]
+
     """ Lấy tọa độ tâm của grid """
     def get_grid_center_cood(self):
         return (int((self.x1 + self.x2) / 2)), (int((self.y1 + self.y2) / 2))
@@ -75,43 +181,47 @@ class RectangularArea:
     def get_grid_name(self):
         return f"({self.index[0]}, {self.index[1]})"
 
+    """ Tính một lần danh sách grid xung quanh dùng cho vận tốc tức thời (tham chiếu trực tiếp tới RectangularArea)
+        _ Hàng 0,1,2,4 (xe đi về phía cột nhỏ): 2 grid kế bên và 3 grid ở cột j+1 phía sau xe
+        _ Các hàng còn lại (xe đi về phía cột lớn): 2 grid kế bên và 3 grid ở cột j-1 phía sau xe"""
+    def link_neighbours(self, dict_grids):
+        i, j = self.index[0], self.index[1]
+        if i in [0,1,2,4]:
+            around = [(i-1, j), (i+1, j), (i, j+1), (i-1, j+1), (i+1, j+1)]
+        else:
+            around = [(i-1, j), (i+1, j), (i, j-1), (i+1, j-1), (i-1, j-1)]
+        names = ("grid_{}_{}" .format(r, c) for r, c in around)
+        self.neighbours = [dict_grids[name] for name in names if name in dict_grids]
+
     """ Nếu grid hiện tại không nằm trong root grid, tiến hành xem xét khu vực 2 grid kế bên và 3 grid phía sau xe
         _ TH1: nếu grid nào có cùng id xe và frame gần nhất thì sẽ dùng nó để tính vận tốc tức thời
         _ TH2 :trường hợp frame lớn nhất gây ra việc chia 0 gây vô nghiệm thì lấy frame lớn thứ hai,...
         _ Th3: nếu tòa bộ frame không có => xóa id này trong grid hiện tại, và root grid """
     def calculate_instant_speed(self,obj_id, dict_grids, root = None):
-        i, j = self.index[0], self.index[1]
-        if i in [0,1,2,4]:
-            grids_around = []
-            grids_around.append("grid_{}_{}" .format(i-1, j))
-            grids_around.append("grid_{}_{}" .format(i+1, j))
-            grids_around.append("grid_{}_{}" .format(i, j+1))
-            grids_around.append("grid_{}_{}" .format(i-1, j+1))
-            grids_around.append("grid_{}_{}" .format(i+1, j+1))
-        else:
-            grids_around = []
-            grids_around.append("grid_{}_{}" .format(i-1, j))
-            grids_around.append("grid_{}_{}" .format(i+1, j))
-            grids_around.append("grid_{}_{}" .format(i, j-1))
-            grids_around.append("grid_{}_{}" .format(i+1, j-1))
-            grids_around.append("grid_{}_{}" .format(i-1, j-1))
-
-        info_grids = [dict_grids[grid] for grid in grids_around if grid in dict_grids]
+        if self.neighbours is None:
+            self.link_neighbours(dict_grids)
+        info_grids = self.neighbours
         if not info_grids:
             return
 
         root_grids_with_obj = [root_grid for root_grid in info_grids if obj_id in root_grid.objects]
         if root_grids_with_obj:
-            max_frames_coords = [(root_grid.objects[obj_id][0], root_grid.objects[obj_id][2]) for root_grid in root_grids_with_obj]
+            max_frames_coords = []
+            for root_grid in root_grids_with_obj:
+                store, row = root_grid.store, root_grid.objects[obj_id]
+                max_frames_coords.append((int(store.frame[row]), (int(store.x[row]), int(store.y[row]))))
             sorted_max_frames_coords = sorted(max_frames_coords, key=lambda x: x[0])
 
+            row = self.objects[obj_id]
+            frame, x, y = int(self.store.frame[row]), int(self.store.x[row]), int(self.store.y[row])
             for h_frame, h_coor in sorted_max_frames_coords:
-                distance = CheckTool.distance(h_coor[0],h_coor[1],self.objects[obj_id][2][0],self.objects[obj_id][2][1])
-                time_diff = self.objects[obj_id][0] - h_frame
+                distance = CheckTool.distance(h_coor[0],h_coor[1],x,y)
+                time_diff = frame - h_frame
 
                 if time_diff != 0:
-                    self.objects[obj_id][3] = round((distance*0.035)*3.6/((self.objects[obj_id][0] - h_frame)/30),2)
-                    print("Xe ", obj_id, "đã vào grid ({}, {}) có vận tốc là {} km/h".format(self.index[0], self.index[1], self.objects[obj_id][3]))
+                    speed = round((distance*0.035)*3.6/((frame - h_frame)/30),2)
+                    self.store.instant[row] = speed
+                    logger.debug("Xe %s đã vào grid (%s, %s) có vận tốc là %s km/h", obj_id, self.index[0], self.index[1], speed)
                     return
 
             # Nếu index hiện tại không nằm trong root grid thì sẽ remove id này ra khỏi root
@@ -121,21 +231,22 @@ class RectangularArea:
                 self.remove_object(obj_id)
                 for root_grid in (dict_grids[root_grid] for root_grid in root):
                     root_grid.remove_object(obj_id)
-                print("KHÔNG CÓ FRAME XUNG QUANH ĐỂ TÍNH => XÓA ID XE {} NÀY".format(obj_id))
+                logger.debug("KHÔNG CÓ FRAME XUNG QUANH ĐỂ TÍNH => XÓA ID XE %s NÀY", obj_id)
                 return
 
         else:
-            print("Xe ", obj_id, "trong grid ({}, {}) không thể tính vận tốc".format(self.index[0], self.index[1]))
+            logger.debug("Xe %s trong grid (%s, %s) không thể tính vận tốc", obj_id, self.index[0], self.index[1])
 
     """ Hàm này sẽ giúp thu thập vận tốc trung bình không gian
         Vận tốc trung bình không gian sẽ được tính dựa trên chiều dài quan trắc
         Tức từ khi bắt đầu vào root grid cho tới khi vừa chạm end grid"""
     def calculate_spatial_speed(self,obj_id, root_grids, dict_grids):
-        frame_end = self.objects[obj_id][0]
+        row = self.objects[obj_id]
+        frame_end = int(self.store.frame[row])
         frame_start = None
         for grid in root_grids:
             if (grid in dict_grids) and (dict_grids[grid].check_object(obj_id)):
-                frame_start = dict_grids[grid].objects[obj_id][0]
+                frame_start = dict_grids[grid].get_object(obj_id)[0]
                 break
 
         if frame_start is None:
@@ -143,8 +254,9 @@ class RectangularArea:
 
         distance = 320 * 0.02
         time = (frame_end - frame_start) / 30
-        self.objects[obj_id][4] = round(distance*3.6 / time, 2)
-        print(f"Xe {obj_id} có vận tốc trung bình không gian là {self.objects[obj_id][4]} km/h")
+        speed = round(distance*3.6 / time, 2)
+        self.store.spatial[row] = speed
+        logger.debug("Xe %s có vận tốc trung bình không gian là %s km/h", obj_id, speed)
 
         "Dùng phần code dưới đây khi bắt đầu thu thập data, vì nó sẽ giúp giảm lượng dữ liệu sau khi thu xong"
         # [dict_grids[grid].remove_object(obj_id) for grid in dict_grids]
@@ -153,13 +265,248 @@ class RectangularArea:
     """ Gán vị trí làn hiện tại cho id khi vào grid cuối """
     def add_name_lane(self,obj_id,grid_under, grid_on):
         if self.index_name in grid_under:
-            self.objects[obj_id][5] = 'Under'
+            self.store.lane[self.objects[obj_id]] = ObjectStore.LANES.index('Under')
         elif self.index_name in grid_on:
-            self.objects[obj_id][5] = 'On'
+            self.store.lane[self.objects[obj_id]] = ObjectStore.LANES.index('On')
 
 
 
     """ Hiển thị thông tin nếu có đối tượng vào grid """
     def show_objects(self):
-        print("Xe ", self.objects, "đã vào grid ({}, {})".format(self.index[0], self.index[1]))
-
+        rows = np.fromiter(self.objects.values(), dtype=np.int64, count=len(self.objects))
+        objects = dict(zip(self.objects, self.store.get_many(rows)))
+        logger.debug("Xe %s đã vào grid (%s, %s)", objects, self.index[0], self.index[1])
+
+
+
+class GridIndex:
+    """ Tra cứu grid chứa điểm (x, y) với chi phí O(1), không phụ thuộc số lượng grid
+        _ Lưới đều: tính hàng và cột bằng phép chia nguyên từ (x_start, y_start)
+        _ Lưới không đều: vẽ sẵn một ảnh nhãn (label image) một lần, mỗi pixel chứa chỉ số grid
+        Điểm nằm trên cạnh chung của hai grid chỉ thuộc về grid gặp trước khi duyệt tuần tự (bên trái / bên trên)"""
+    def __init__(self, cells, n_rows=None, n_cols=None, x_start=0, y_start=0, cell_width=1, cell_height=1, label=None):
+        self.cells = cells
+        self.n_rows = n_rows
+        self.n_cols = n_cols
+        self.x_start = x_start
+        self.y_start = y_start
+        self.cell_width = cell_width
+        self.cell_height = cell_height
+        self.label = label
+
+    """ Lưới đều, cells được sắp xếp theo hàng (cells[r * n_cols + c]) """
+    @classmethod
+    def regular(cls, cells, n_rows, n_cols, x_start, y_start, cell_width, cell_height):
+        return cls(list(cells), n_rows, n_cols, x_start, y_start, cell_width, cell_height)
+
+    """ Lưới bất kỳ: vẽ các RectangularArea lên ảnh nhãn kích thước (height, width)
+        Vẽ ngược để khi chồng lấn, grid đứng trước trong danh sách được ưu tiên như khi duyệt tuần tự"""
+    @classmethod
+    def from_areas(cls, areas, width, height):
+        cells = list(areas)
+        label = np.full((height, width), -1, dtype=np.int32)
+        for idx in range(len(cells) - 1, -1, -1):
+            area = cells[idx]
+            label[max(0, area.top):max(0, area.bottom + 1), max(0, area.left):max(0, area.right + 1)] = idx
+        return cls(cells, label=label)
+
+    """ Trả về RectangularArea chứa điểm (x, y), hoặc None nếu nằm ngoài lưới """
+    def lookup(self, x, y):
+        if self.label is not None:
+            if 0 <= y < self.label.shape[0] and 0 <= x < self.label.shape[1]:
+                idx = self.label[int(y), int(x)]
+                return self.cells[idx] if idx >= 0 else None
+            return None
+
+        c = int((x - self.x_start) // self.cell_width)
+        r = int((y - self.y_start) // self.cell_height)
+        # contains() tính cả cạnh: điểm nằm đúng trên cạnh thuộc grid bên trái / bên trên
+        if c > 0 and x == self.x_start + c * self.cell_width:
+            c -= 1
+        if r > 0 and y == self.y_start + r * self.cell_height:
+            r -= 1
+        if 0 <= c < self.n_cols and 0 <= r < self.n_rows:
+            return self.cells[r * self.n_cols + c]
+        return None
+
+    """ Tra cứu nhiều điểm cùng lúc, trả về mảng chỉ số trong cells (-1 nếu nằm ngoài lưới)
+        Cùng quy tắc với lookup(), nhưng tính bằng một phép toán mảng cho tất cả các xe """
+    def lookup_many(self, xs, ys):
+        xs = np.asarray(xs)
+        ys = np.asarray(ys)
+        if self.label is not None:
+            inside = (xs >= 0) & (ys >= 0) & (ys < self.label.shape[0]) & (xs < self.label.shape[1])
+            idx = np.full(xs.shape, -1, dtype=np.int64)
+            idx[inside] = self.label[ys[inside].astype(np.int64), xs[inside].astype(np.int64)]
+            return idx
+
+        c = np.floor_divide(xs - self.x_start, self.cell_width).astype(np.int64)
+        r = np.floor_divide(ys - self.y_start, self.cell_height).astype(np.int64)
+        c -= (c > 0) & (xs == self.x_start + c * self.cell_width)
+        r -= (r > 0) & (ys == self.y_start + r * self.cell_height)
+        inside = (c >= 0) & (c < self.n_cols) & (r >= 0) & (r < self.n_rows)
+        return np.where(inside, r * self.n_cols + c, -1)
+
+
+class GridLayout:
+    """ Lưới các RectangularArea đều nhau bắt đầu từ (x_start, y_start), cùng với các grid gốc (root) và grid cuối (end)
+        _ Làn On (hàng 0 tới lane_split - 1): xe đi từ cột cuối về cột 0
+        _ Làn Under (hàng lane_split trở đi): xe đi từ cột 0 tới cột cuối"""
+    def __init__(self, n_rows=11, n_cols=9, cell_width=40, cell_height=30, x_start=577, y_start=288, lane_split=5,
+                 keep_records=False, start_time=datetime.datetime(2019, 10, 30, 8, 0, 0), fps=30):
+        self.n_rows = n_rows
+        self.n_cols = n_cols
+        self.cell_width = cell_width
+        self.cell_height = cell_height
+        self.x_start = x_start
+        self.y_start = y_start
+        self.start_time = start_time
+        self.fps = fps
+
+        self.store = ObjectStore() # Bảng trạng thái dùng chung cho mọi grid của lưới
+        self.grids = {} # Nơi trữ biến grid với key: là tên grid - value: class grid
+        for r in range(n_rows):
+            y1 = y_start + r * cell_height
+            y2 = y_start + (r+1) * cell_height
+            for c in range(n_cols):
+                x1 = x_start + c * cell_width
+                x2 = x_start + (c+1) * cell_width
+                self.grids[f"grid_{r}_{c}"] = RectangularArea(r, c, x1, y1, x2, y2, store=self.store)
+        # Thứ tự chèn của dict là theo hàng, đúng với thứ tự GridIndex cần
+        self.index = GridIndex.regular(self.grids.values(), n_rows, n_cols, x_start, y_start, cell_width, cell_height)
+        for grid in self.grids.values():
+            grid.link_neighbours(self.grids)
+            grid.layout = self
+
+        self.root_grids_on = [f"grid_{r}_{n_cols - 1}" for r in range(lane_split)]
+        self.root_grids_under = [f"grid_{r}_0" for r in range(lane_split, n_rows)]
+        self.end_grids_on = [f"grid_{r}_0" for r in range(lane_split)]
+        self.end_grids_under = [f"grid_{r}_{n_cols - 1}" for r in range(lane_split, n_rows)]
+        self.root_grids = self.root_grids_on + self.root_grids_under
+        self.root_names = frozenset(self.root_grids)
+        self.root_cells = frozenset(self.grids[name] for name in self.root_grids)
+        self.end_cells = frozenset(self.grids[name] for name in self.end_grids_on + self.end_grids_under)
+        # id xe -> số root grid đang giữ id đó, cập nhật qua add_object / remove_object
+        self.root_entries = {}
+        # id xe -> các grid đang giữ id đó theo thứ tự đi qua, dùng để xóa id khỏi lưới
+        self.paths = {}
+        self.keep_records = keep_records
+        self.records = []
+
+    """ Được RectangularArea gọi khi có id mới vào grid """
+    def object_added(self, grid, obj_id):
+        self.paths.setdefault(obj_id, []).append(grid)
+        if grid in self.root_cells:
+            self.root_entries[obj_id] = self.root_entries.get(obj_id, 0) + 1
+
+    """ Được RectangularArea gọi khi id bị xóa khỏi grid """
+    def object_removed(self, grid, obj_id):
+        path = self.paths.get(obj_id)
+        if path is not None and grid in path:
+            path.remove(grid)
+            if not path:
+                del self.paths[obj_id]
+        if grid in self.root_cells:
+            count = self.root_entries.get(obj_id, 0) - 1
+            if count > 0:
+                self.root_entries[obj_id] = count
+            else:
+                self.root_entries.pop(obj_id, None)
+
+    """ Xóa id khỏi mọi grid đang giữ nó (xe đã kết thúc), giải phóng các dòng trong self.store """
+    def evict(self, obj_id):
+        for grid in self.paths.pop(obj_id, []):
+            grid.remove_object(obj_id)
+        self.root_entries.pop(obj_id, None)
+
+    """ id này đã từng đi qua root grid chưa (O(1)) """
+    def entered_root(self, obj_id):
+        return obj_id in self.root_entries
+
+    """ Thời điểm của một frame (frame đầu tiên là 1) """
+    def frame_time(self, frame):
+        return self.start_time + datetime.timedelta(seconds=frame / self.fps)
+
+    """ Vùng bao toàn bộ lưới (x, y, w, h) """
+    def extent(self):
+        return (self.x_start, self.y_start, self.n_cols * self.cell_width, self.n_rows * self.cell_height)
+
+    """ Cập nhật vị trí tâm (cx, cy) của một xe vào các grid chứa nó
+        Trả về list (grid, vận tốc, là vận tốc không gian hay không) cần hiển thị cho xe này
+        Khi xe vừa vào grid cuối và có vận tốc không gian, bản ghi sẽ được thêm vào self.records (nếu keep_records = True)"""
+    def update(self, object_id, cx, cy, frame):
+        # Chỉ một phép tra cứu cho mỗi xe thay vì duyệt toàn bộ grids
+        return self.update_cell(self.index.lookup(cx, cy), object_id, cx, cy, frame)
+
+    """ Cập nhật tất cả xe của một frame: object_ids (N), centers (N x 2)
+        Tra cứu grid cho cả N xe bằng một phép toán mảng, bỏ qua ngay các xe nằm ngoài lưới
+        Trả về danh sách (object_id, speeds) cho các xe có vận tốc để hiển thị """
+    def update_many(self, object_ids, centers, frame):
+        centers = np.asarray(centers).reshape(-1, 2)
+        cells = self.index.lookup_many(centers[:, 0], centers[:, 1])
+        results = []
+        for i in np.flatnonzero(cells >= 0):
+            object_id = int(object_ids[i])
+            cx, cy = int(centers[i, 0]), int(centers[i, 1])
+            speeds = self.update_cell(self.index.cells[cells[i]], object_id, cx, cy, frame)
+            if speeds:
+                results.append((object_id, speeds))
+        return results
+
+    """ Cập nhật một xe khi đã biết grid v1 chứa tâm (cx, cy) """
+    def update_cell(self, v1, object_id, cx, cy, frame):
+        speeds = []
+        if v1 is None:
+            return speeds
+
+        # Nếu trong grids gốc (root_grids) thì thêm thông tin vào grid gốc
+        if (v1 in self.root_cells) and (v1.check_object(object_id) == False):
+            v1.add_object(object_id, frame, [cx, cy])
+        # Nếu grids hiện tại không phải grid gốc thì check xem id có trong root grids gốc thì mới thêm, không thì không thêm
+        else:
+            root_object_exist = self.entered_root(object_id)
+            end_object_exist = v1 in self.end_cells
+
+            if (v1.check_object(object_id) == False) and root_object_exist:
+                v1.add_object(object_id, frame, [cx, cy])
+                v1.calculate_instant_speed(object_id, self.grids, self.root_names)
+                # calculate_instant_speed có thể đã xóa id này nếu không có frame xung quanh
+                if end_object_exist and v1.check_object(object_id):
+                    v1.calculate_spatial_speed(object_id, self.root_grids, self.grids)
+                    v1.add_name_lane(object_id, self.end_grids_under, self.end_grids_on)
+                    if logger.isEnabledFor(logging.DEBUG):
+                        v1.show_objects()
+                    if self.keep_records:
+                        self.records.append(self.make_record(v1, object_id))
+
+            elif (v1.check_object(object_id) == True) and root_object_exist and end_object_exist:
+                speeds.append((v1, v1.get_spatial_speed(object_id), True))
+
+            # Nếu có rồi thì hiển thị tốc độ đã được lưu vào từ trước ra
+            elif (v1.check_object(object_id) == True) and root_object_exist and not end_object_exist:
+                speeds.append((v1, v1.get_instant_speed(object_id), False))
+
+        return speeds
+
+    """ Tạo bản ghi cho xe vừa tới grid cuối
+        Vào (entry) là frame xe vào grid gốc đầu tiên trên đường đi, ra (exit) là frame xe vào grid cuối
+        path: tên các grid xe đã đi qua theo thứ tự """
+    def make_record(self, end_grid, object_id):
+        frame, coords, instant, spatial, lane = end_grid.get_object(object_id)
+        path = self.paths.get(object_id, [])
+        entry_grid = next((grid for grid in path if grid in self.root_cells), None)
+        entry_frame = entry_grid.get_object(object_id)[0] if entry_grid is not None else frame
+        return {'id': object_id,
+                'lane': lane,
+                'entry_frame': entry_frame,
+                'entry_time': self.frame_time(entry_frame),
+                'exit_frame': frame,
+                'exit_time': self.frame_time(frame),
+                'instant_speed': instant,
+                'spatial_speed': spatial,
+                'path': [grid.index_name for grid in path]}
+
+    """ Lấy ra các bản ghi mới kể từ lần gọi trước """
+    def pop_records(self):
+        records, self.records = self.records, []
+        return records
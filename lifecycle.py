@@ -0,0 +1,59 @@
+from collections import OrderedDict
+
+class TrackLifecycle:
+    """
+    Evicts track ids from every per-id store once they are finished
+    An id is evicted when deep_sort deletes its track, or when it has not been
+    seen for `max_idle` frames. Flush hooks run before the stores are cleared so
+    completed records reach the output sink first.
+    """
+    def __init__(self, max_idle=90):
+        self.max_idle = max_idle
+        self.last_seen = OrderedDict()  # id -> last frame, oldest first
+        self.stores = []
+        self.flushers = []
+        self.evicted = 0
+
+    def register(self, name, evict):
+        """Register a store; `evict(track_id)` must drop every entry of that id"""
+        self.stores.append((name, evict))
+
+    def register_flush(self, flush):
+        """Register `flush(track_id)`, called before an id is evicted"""
+        self.flushers.append(flush)
+
+    def step(self, frame, object_ids, deleted_ids=()):
+        """Record the ids seen this frame, then evict deleted and stale ones; returns the evicted ids"""
+        for object_id in object_ids:
+            self.last_seen[object_id] = frame
+            self.last_seen.move_to_end(object_id)
+
+        evicted = [object_id for object_id in deleted_ids if object_id in self.last_seen]
+        for object_id in evicted:
+            del self.last_seen[object_id]
+
+        # Ids are kept in last-seen order, so stale ones are all at the front
+        while self.last_seen:
+            object_id, last_frame = next(iter(self.last_seen.items()))
+            if frame - last_frame <= self.max_idle:
+                break
+            del self.last_seen[object_id]
+            evicted.append(object_id)
+
+        for object_id in evicted:
+            self.evict(object_id)
+        return evicted
+
+    def evict(self, object_id):
+        for flush in self.flushers:
+            flush(object_id)
+        for _, evict in self.stores:
+            evict(object_id)
+        self.last_seen.pop(object_id, None)
+        self.evicted += 1
+
+    def stats(self):
+        return {"live": len(self.last_seen), "evicted": self.evicted}
+
+    def report(self):
+        return f"live IDs: {len(self.last_seen)} | evicted IDs: {self.evicted}"
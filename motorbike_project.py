@@ -1,16 +1,43 @@
+import argparse
+import os
+import signal
 import cv2
 import numpy as np
 import datetime
 from object_detection import ObjectDetection
 from deep_sort_wrapper import Deep
-from grid import RectangularArea, CheckTool
+from grid import GridLayout
+from frame_mask import FrameMask
+from lifecycle import TrackLifecycle
+from sinks import open_sink
+
+parser = argparse.ArgumentParser(description="Detect and track motorbikes in a.mp4 and record their speeds")
+parser.add_argument("--headless", action="store_true",
+                    help="no windows and no drawing; send SIGUSR1 to save an annotated snapshot to output/")
+parser.add_argument("--preview-every", type=int, default=1,
+                    help="draw and show only every Nth frame (ignored with --headless)")
+args = parser.parse_args()
+
+# Khung hình được vẽ khi đến lượt preview, hoặc khi nhận SIGUSR1 (kill -USR1 <pid>)
+preview_requested = False
+
+
+def request_preview(signum, stack):
+    global preview_requested
+    preview_requested = True
+
+
+if hasattr(signal, "SIGUSR1"):
+    signal.signal(signal.SIGUSR1, request_preview)
 
 # Load Object Detection
 od = ObjectDetection("yolov4.weights", "yolov4.cfg")
 od.load_class_names("coco.names")
+motorbike_class_id = od.classes.index("motorbike")
 od.load_detection_model(image_size=416, # 416 - 1280
                         nmsThreshold=0.4,
-                        confThreshold=0.3)
+                        confThreshold=0.3,
+                        target_classes=["motorbike"]) # Chỉ giữ xe máy ngay khi giải mã, trước NMS
 
 # Load Object Tracking Deep Sort
 deep = Deep(max_distance=0.7,
@@ -23,6 +50,7 @@ tracker = deep.sort_tracker()
 mask = cv2.imread("new_mask.jpeg")
 if mask is None:
     print("Warning: Mask file not found. Using full frame.")
+frame_mask = FrameMask(mask)
 
 cap = cv2.VideoCapture("a.mp4")
 if not cap.isOpened():
@@ -31,7 +59,7 @@ if not cap.isOpened():
 
 # Biến ______________________________________________________________________________________________
 frame_count = 0 # Để ghi frame khi xe vào từng vùng, bắt đầu từ frame 0
-timestamp = datetime.datetime(2019, 10, 30, 8, 0, 0, 000000) #Thời gian dự định tạo, bắt đầu lúc 8:00 ngày 2019/12/30
+start_time = datetime.datetime(2019, 10, 30, 8, 0, 0, 000000) #Thời gian dự định tạo, bắt đầu lúc 8:00 ngày 2019/12/30, thời gian của mỗi frame được tính lại từ frame_count
 # Biến ______________________________________________________________________________________________
 
 # Vẽ grid ____________________________________________________________________________________________
@@ -44,101 +72,49 @@ cell_height = 30
 x_start = 577
 y_start = 288
 
-grids = {} # Nơi trữ biến grid với key: là tên grid - value: class grid
-root_grids_on = CheckTool.create_name_grid(8,number_name=5)
-root_grids_under = CheckTool.create_name_grid(0,number_name=11,start=5)
-end_grids_on = CheckTool.create_name_grid(0,number_name=5)
-end_grids_under = CheckTool.create_name_grid(8,number_name=11,start=5)
-
-for r in range(n_rows):
-    y1 = y_start + r * cell_height
-    y2 = y_start + (r+1) * cell_height
-    for c in range(n_cols):
-        x1 = x_start + c * cell_width
-        x2 = x_start + (c+1) * cell_width
-        grids[f"grid_{r}_{c}"] = RectangularArea(r, c, x1, y1, x2, y2) #Tạo biến hàng loạt và chứa trong dict
-        # print("grid {}, {}".format(r,c),x1, y1, x2, y2)
+grid_layout = GridLayout(n_rows, n_cols, cell_width, cell_height, x_start, y_start, start_time=start_time, fps=30,
+                         keep_records=True)
+# Bản ghi của từng xe (vào/ra, vận tốc, đường đi qua các grid) được ghi theo lô ra file CSV cuộn
+sink = open_sink("output/speed_records.csv")
+grids = grid_layout.grids # Nơi trữ biến grid với key: là tên grid - value: class grid
+
+# Xóa id khỏi grid và tracker khi deep_sort xóa track hoặc id không xuất hiện trong 90 frame
+lifecycle = TrackLifecycle(max_idle=90)
+lifecycle.register("grids", grid_layout.evict)
+lifecycle.register("tracker", tracker.evict)
+# Bản ghi đã hoàn thành được ghi ra sink trước khi id bị xóa khỏi grid
+lifecycle.register_flush(lambda object_id: sink.write_many(grid_layout.pop_records()))
 # Vẽ grid ____________________________________________________________________________________________
 
+# Only run detection on the region covered by the mask (or the grid when there is no mask)
+if mask is not None:
+    od.set_roi(mask=mask)
+else:
+    od.set_roi(rect=(x_start, y_start, n_cols * cell_width, n_rows * cell_height))
+# Chạy forward đầu tiên (chậm) trước khi đọc frame đầu (bỏ qua nếu webcam chưa báo kích thước, 0x0)
+od.warmup((int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))))
 
-while True:
-    ret, frame = cap.read()
-    if not ret:
-        break
-    frame_count += 1
-    timestamp += datetime.timedelta(seconds=1/30)
-
-    # Apply mask if available
-    if mask is not None:
-        # Resize mask to match frame size
-        mask_resized = cv2.resize(mask, (frame.shape[1], frame.shape[0]))
-        frame_region = cv2.bitwise_and(frame, mask_resized)
-    else:
-        frame_region = frame
-    """ 1. Object Detection """
-    (class_ids, scores, boxes) = od.detect(frame_region)
-    # for class_id, score, box in zip(class_ids, scores, boxes):
-    #     x, y, w, h = box
-    #     cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 255, 0), 2)
-
-    """ 2. Object Tracking """
-    features = deep.encoder(frame_region, boxes)
-    detections = deep.Detection(boxes, scores, class_ids, features)
-
-    tracker.predict()
-    (class_ids, object_ids, boxes) = tracker.update(detections)
 
-    for class_id, object_id, box in zip(class_ids, object_ids, boxes):
+# Vẽ box, id, vận tốc và grid lên frame và frame_region, chỉ gọi cho frame được preview
+def draw(frame, frame_region, class_ids, object_ids, boxes, centers, is_motorbike, grid_speeds):
+    for class_id, object_id, box, center, motorbike in zip(class_ids.tolist(), object_ids.tolist(), boxes.tolist(),
+                                                          centers.tolist(), is_motorbike.tolist()):
 
         (x, y, x2, y2) = box
-        class_name = od.classes[class_id]
         color = od.colors[class_id]
 
-        if class_name in ["motorbike"]:
-            color = od.colors[class_id]
-            cx = int((x + x2) / 2)
-            cy = int((y + y2) / 2)
+        if motorbike:
+            (cx, cy) = center
             cv2.circle(frame, (cx, cy), 4, color, -1)
             cv2.circle(frame_region, (cx, cy), 4, color, -1)
             cv2.putText(frame, str(object_id), (cx -10 , cy ), 0, 0.60, (0, 0, 255), 2)
             cv2.putText(frame_region, str(object_id), (cx -10 , cy), 0, 0.60, (0, 0, 255), 2)
 
-
-            # Đang có vấn đề ở đây
-            current_grid = None
-            for k1, v1 in grids.items():
-                # Nếu không trong grids thì lướt
-                if not v1.contains(cx, cy):
-                    continue
-
-                # Nếu trong grids gốc (root_grids) thì thêm thông tin vào grid gốc
-                if ((k1 in root_grids_on) or (k1 in root_grids_under)) and (v1.check_object(object_id) == False):
-                    v1.add_object(object_id, frame_count, timestamp, [cx, cy])
-                # Nếu grids hiện tại không phải grid gốc thì check xem id có trong root grids gốc thì mới thêm, không thì không thêm
-                else:
-                    root_object_exist = sum(root_grid.check_object(object_id) for root_grid in (grids[key] for key in root_grids_on + root_grids_under))
-                    end_object_exist = 1 if v1.index_name in end_grids_on + end_grids_under else 0
-
-
-                    if (v1.check_object(object_id) == False) and (root_object_exist > 0):
-                        v1.add_object(object_id, frame_count, timestamp, [cx, cy])
-                        v1.calculate_instant_speed(object_id,grids,root_grids_on+root_grids_under)
-                        if end_object_exist > 0:
-                            v1.calculate_spatial_speed(object_id,root_grids_on+root_grids_under,grids)
-                            v1.add_name_lane(object_id,end_grids_under,end_grids_on)
-                            v1.show_objects()
-
-                    elif (v1.check_object(object_id) == True) and (root_object_exist > 0) and (end_object_exist > 0):
-                        cv2.putText(frame, str(v1.objects[object_id][4]) +" km/h", (cx - 20, cy+28), 0, 0.50, (255, 100, 0), 2)
-                        cv2.putText(frame_region, str(v1.objects[object_id][4]) +" km/h", (cx - 25 , cy+28), 0, 0.50, (255, 100, 0), 2)
-
-                    # Nếu có rồi thì hiển thị tốc độ đã được lưu vào từ trước ra
-                    elif (v1.check_object(object_id) == True) and (root_object_exist > 0) and (end_object_exist == 0):
-                        cv2.putText(frame, str(v1.objects[object_id][3]) +" km/h", (cx - 20, cy+28), 0, 0.50, (255, 0, 0), 2)
-                        cv2.putText(frame_region, str(v1.objects[object_id][3]) +" km/h", (cx - 25 , cy+28), 0, 0.50, (255, 0, 0), 2)
-
-
-
+            # Hiển thị vận tốc đã lưu của xe
+            for _, speed, spatial in grid_speeds.get(object_id, []):
+                speed_color = (255, 100, 0) if spatial else (255, 0, 0)
+                cv2.putText(frame, str(speed) +" km/h", (cx - 20, cy+28), 0, 0.50, speed_color, 2)
+                cv2.putText(frame_region, str(speed) +" km/h", (cx - 25 , cy+28), 0, 0.50, speed_color, 2)
 
         cv2.rectangle(frame, (x, y), (x2, y2), color, 2)
         # cv2.rectangle(frame, (x, y), (x + len(class_name) * 20, y - 30), color, -1)
@@ -157,6 +133,51 @@ while True:
         cv2.putText(frame, v2.get_grid_name(), (v2.get_grid_center_cood()[0] -20,v2.get_grid_center_cood()[1]), 0, 0.40, (255, 255, 255), 1)
 
 
+while True:
+    ret, frame = cap.read()
+    if not ret:
+        break
+    frame_count += 1
+
+    # Apply mask if available (resized once, written into a reused buffer)
+    frame_region = frame_mask.apply(frame)
+    """ 1. Object Detection """
+    (class_ids, scores, boxes) = od.detect(frame_region)
+    # for class_id, score, box in zip(class_ids, scores, boxes):
+    #     x, y, w, h = box
+    #     cv2.rectangle(frame, (x, y), (x + w, y + h), (0, 255, 0), 2)
+
+    """ 2. Object Tracking """
+    features = deep.encoder(frame_region, boxes)
+    detections = deep.Detection(boxes, scores, class_ids, features)
+
+    tracker.predict()
+    (class_ids, object_ids, boxes) = tracker.update_arrays(detections)
+    lifecycle.step(frame_count, object_ids.tolist(), tracker.deleted_ids)
+    if frame_count % 1800 == 0:
+        print(f"Frame {frame_count}: {lifecycle.report()} | {deep.report()}")
+
+    # Tâm của tất cả xe máy, cập nhật grid cho cả frame bằng một lần tra cứu mảng
+    centers = ((boxes[:, :2] + boxes[:, 2:]) / 2).astype(int)
+    is_motorbike = class_ids == motorbike_class_id
+    grid_speeds = dict(grid_layout.update_many(object_ids[is_motorbike], centers[is_motorbike], frame_count))
+    # Ghi ngay trong frame bản ghi được tạo; flush đã đăng ký với lifecycle vẫn bảo đảm
+    # bản ghi ra sink trước khi id bị xóa nếu thứ tự các bước này thay đổi
+    sink.write_many(grid_layout.pop_records())
+
+    render = preview_requested or (not args.headless and frame_count % max(args.preview_every, 1) == 0)
+    if not render:
+        continue
+    preview_requested = False
+    draw(frame, frame_region, class_ids, object_ids, boxes, centers, is_motorbike, grid_speeds)
+
+    if args.headless:
+        snapshot = f"output/preview_{frame_count:06d}.jpg"
+        os.makedirs("output", exist_ok=True)
+        cv2.imwrite(snapshot, frame)
+        print(f"Frame {frame_count}: preview saved to {snapshot}")
+        continue
+
     cv2.imshow("Frame", frame)
     cv2.imshow("Mask", mask)
     cv2.imshow("Frame Region", frame_region)
@@ -166,4 +187,7 @@ while True:
         break
 
 cap.release()
-cv2.destroyAllWindows()
+if not args.headless:
+    cv2.destroyAllWindows()
+sink.close()
+print(f"Speed records: {sink.written} -> {', '.join(sink.paths)}")
@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+"""
+Motorbike Detection Project - Multi-camera runner
+Processes several video sources in parallel, one worker process per stream
+(or a pool sized to the core count), each with its own ObjectDetection and
+Deep tracker. Speed records of all cameras are merged into one output
+(rolling CSV/Parquet files or a SQLite database, see sinks.py).
+
+  python3 multi_camera.py cameras.json --output speeds.csv
+  python3 multi_camera.py --sources cam1.mp4 cam2.mp4 cam3.mp4
+"""
+import argparse
+import json
+import multiprocessing as mp
+import os
+import queue
+import time
+
+import sinks
+
+DEFAULT_MODEL = {
+    "weights": "yolov4.weights",
+    "config": "yolov4.cfg",
+    "classes": "coco.names",
+    "image_size": 416,
+    "nmsThreshold": 0.4,
+    "confThreshold": 0.3,
+    "target_classes": ["motorbike"],  # filtered while decoding, before NMS
+    "class_thresholds": {},  # e.g. {"motorbike": 0.25}
+    "backend": "opencv",  # "openvino", or "auto" to time the available CPU backends
+    "target": "cpu",  # "cpu_fp16" where supported
+}
+
+DEFAULT_TRACKER = {
+    "max_distance": 0.7,
+    "nms_max_overlap": 1,
+    "n_init": 3,
+    "max_age": 15,
+    "max_iou_distance": 0.7,
+    "motion_only": False,  # Kalman + IoU only, for dense scenes on CPU-only hosts
+}
+
+DEFAULT_GRID = {
+    "n_rows": 11,
+    "n_cols": 9,
+    "cell_width": 40,
+    "cell_height": 30,
+    "x_start": 577,
+    "y_start": 288,
+}
+
+RECORD_FIELDS = ("camera",) + sinks.RECORD_FIELDS
+
+# Seconds between checks that the workers still running a camera are alive
+POLL_INTERVAL = 5.0
+
+
+def load_config(path):
+    """
+    Camera config file:
+    {"model": {...}, "tracker": {...},
+     "cameras": [{"name": "cam1", "source": "a.mp4", "mask": "new_mask.jpeg",
+                  "grid": {"x_start": 577, "y_start": 288}}]}
+    """
+    with open(path, 'r') as f:
+        config = json.load(f)
+    return config
+
+
+def camera_configs(config):
+    cameras = []
+    for i, camera in enumerate(config.get("cameras", [])):
+        camera = dict(camera)
+        camera.setdefault("name", f"cam{i}")
+        camera["grid"] = {**DEFAULT_GRID, **camera.get("grid", {})}
+        camera.setdefault("mask", None)
+        cameras.append(camera)
+    return cameras
+
+
+def run_camera(camera, model, tracker_params, threads, results):
+    """Worker entry point: never let an exception leave the main process waiting"""
+    # The main process watches this pid in case the worker dies without a word (segfault, OOM kill)
+    results.put(("start", camera["name"], os.getpid()))
+    try:
+        process_camera(camera, model, tracker_params, threads, results)
+    except Exception as e:
+        results.put(("error", camera["name"], f"{type(e).__name__}: {e}"))
+
+
+def process_camera(camera, model, tracker_params, threads, results):
+    """Full detection -> tracking -> grid pipeline for one stream"""
+    import cv2
+    from object_detection import ObjectDetection
+    from deep_sort_wrapper import Deep
+    from grid import GridLayout
+    from frame_mask import FrameMask
+    from lifecycle import TrackLifecycle
+
+    name = camera["name"]
+
+    od = ObjectDetection(model["weights"], model["config"])
+    od.load_class_names(model["classes"])
+    motorbike_class_id = od.classes.index("motorbike")
+    od.load_detection_model(image_size=model["image_size"],
+                            nmsThreshold=model["nmsThreshold"],
+                            confThreshold=model["confThreshold"],
+                            target_classes=model["target_classes"],
+                            class_thresholds=model["class_thresholds"],
+                            backend=model["backend"],
+                            target=model["target"],
+                            # Split the cores between workers instead of letting every DNN use all of them
+                            num_threads=threads)
+    deep = Deep(**tracker_params)
+    tracker = deep.sort_tracker()
+
+    grid_layout = GridLayout(keep_records=True, **camera["grid"])
+    lifecycle = TrackLifecycle()
+    lifecycle.register("grids", grid_layout.evict)
+    lifecycle.register("tracker", tracker.evict)
+
+    def send_records(object_id=None):
+        records = grid_layout.pop_records()
+        if records:
+            results.put(("records", name, records))
+    # Completed records always leave before their id is evicted from the grid
+    lifecycle.register_flush(send_records)
+    mask = cv2.imread(camera["mask"]) if camera["mask"] else None
+    frame_mask = FrameMask(mask)
+    if mask is not None:
+        od.set_roi(mask=mask)
+    else:
+        od.set_roi(rect=grid_layout.extent())
+
+    cap = cv2.VideoCapture(camera["source"])
+    if not cap.isOpened():
+        results.put(("error", name, f"cannot open {camera['source']}"))
+        return
+
+    grid_layout.fps = cap.get(cv2.CAP_PROP_FPS) or 30
+    od.warmup((int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))))
+    frame_count = 0
+    start = time.perf_counter()
+
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frame_count += 1
+
+        frame_region = frame_mask.apply(frame)
+        (class_ids, scores, boxes) = od.detect(frame_region)
+
+        features = deep.encoder(frame_region, boxes)
+        detections = deep.Detection(boxes, scores, class_ids, features)
+        tracker.predict()
+        (class_ids, object_ids, boxes) = tracker.update_arrays(detections)
+
+        # Tracks carry the majority class of their detections: drop the rest before any grid work
+        is_motorbike = class_ids == motorbike_class_id
+        centers = ((boxes[is_motorbike, :2] + boxes[is_motorbike, 2:]) / 2).astype(int)
+        grid_layout.update_many(object_ids[is_motorbike], centers, frame_count)
+
+        # One message per frame with the records completed in it
+        send_records()
+        lifecycle.step(frame_count, object_ids.tolist(), tracker.deleted_ids)
+
+    cap.release()
+    results.put(("done", name, frame_count, time.perf_counter() - start,
+                 f"first frame after {od.time_to_first_frame or 0:.1f}s | {lifecycle.report()}"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("config", nargs="?", help="camera config JSON file")
+    parser.add_argument("--sources", nargs="+", default=[], help="video sources using the default camera config")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: min(streams, cores))")
+    parser.add_argument("--output", default="speed_records.csv",
+                        help="merged output: .csv / .parquet (rolling files) or .db (SQLite)")
+    args = parser.parse_args()
+
+    config = load_config(args.config) if args.config else {}
+    config.setdefault("cameras", [])
+    config["cameras"] += [{"source": source} for source in args.sources]
+    cameras = camera_configs(config)
+    if not cameras:
+        parser.error("no cameras: pass a config file or --sources")
+
+    model = {**DEFAULT_MODEL, **config.get("model", {})}
+    tracker_params = {**DEFAULT_TRACKER, **config.get("tracker", {})}
+    cores = os.cpu_count() or 1
+    workers = args.workers or min(len(cameras), cores)
+    threads = max(1, cores // workers)
+
+    print("=" * 70)
+    print(f"Multi-camera run: {len(cameras)} streams, {workers} worker processes, {threads} OpenCV threads each")
+    print("=" * 70)
+
+    # spawn: OpenCV is not fork-safe once its thread pool is running
+    ctx = mp.get_context("spawn")
+    manager = ctx.Manager()
+    results = manager.Queue()
+    start = time.perf_counter()
+
+    with ctx.Pool(processes=workers) as pool, sinks.open_sink(args.output, fields=RECORD_FIELDS) as sink:
+        jobs = pool.starmap_async(run_camera, [(camera, model, tracker_params, threads, results) for camera in cameras])
+
+        finished = 0
+        total_frames = 0
+        running = {}  # camera name -> pid of the worker processing it
+        lost = []
+        while finished < len(cameras):
+            try:
+                message = results.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                alive = {process.pid for process in mp.active_children()}
+                for name, pid in list(running.items()):
+                    if pid not in alive:
+                        del running[name]
+                        lost.append(name)
+                        finished += 1
+                        print(f"✗ {name}: worker process {pid} died")
+                if jobs.ready() and not running:
+                    # Every job returned, so no message is still on its way
+                    break
+                continue
+
+            if message[0] == "start":
+                _, name, pid = message
+                running[name] = pid
+            elif message[0] == "records":
+                _, name, records = message
+                sink.write_many({"camera": name, **record} for record in records)
+            elif message[0] == "done":
+                _, name, frames, elapsed, summary = message
+                running.pop(name, None)
+                finished += 1
+                total_frames += frames
+                print(f"✓ {name}: {frames} frames in {elapsed:.1f}s ({frames / max(elapsed, 1e-9):.1f} FPS) | {summary}")
+            else:
+                _, name, error = message
+                running.pop(name, None)
+                finished += 1
+                print(f"✗ {name}: {error}")
+        # A job lost with its worker never completes; leaving the pool block terminates the rest
+        if not lost:
+            jobs.get()
+
+    elapsed = time.perf_counter() - start
+    print("=" * 70)
+    print(f"Total: {total_frames} frames in {elapsed:.1f}s ({total_frames / max(elapsed, 1e-9):.1f} FPS across all streams)")
+    outputs = ", ".join(sink.paths) if isinstance(sink, sinks.RollingFileSink) else args.output
+    print(f"Speed records: {sink.written} written to {outputs or args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,46 @@
+import os
+import threading
+import time
+
 import cv2
 import numpy as np
 
+# Names accepted by load_detection_model(); constants missing from this OpenCV build are left out
+DNN_BACKENDS = {name: getattr(cv2.dnn, const) for name, const in (
+    ("opencv", "DNN_BACKEND_OPENCV"),
+    ("openvino", "DNN_BACKEND_INFERENCE_ENGINE"),
+    ("default", "DNN_BACKEND_DEFAULT"),
+) if hasattr(cv2.dnn, const)}
+DNN_TARGETS = {name: getattr(cv2.dnn, const) for name, const in (
+    ("cpu", "DNN_TARGET_CPU"),
+    ("cpu_fp16", "DNN_TARGET_CPU_FP16"),
+    ("opencl", "DNN_TARGET_OPENCL"),
+    ("opencl_fp16", "DNN_TARGET_OPENCL_FP16"),
+) if hasattr(cv2.dnn, const)}
+# Targets tried by backend="auto"; the project runs on CPU-only hosts
+AUTO_TARGETS = ("cpu", "cpu_fp16")
+
+class SharedNet:
+    """A loaded cv2.dnn net and the lock that serialises forward passes on it"""
+    def __init__(self, net, output_layers, backend, load_time):
+        self.net = net
+        self.output_layers = output_layers
+        self.backend = backend
+        self.load_time = load_time
+        self.lock = threading.Lock()
+        self.users = 0
+
+# Process-wide: every ObjectDetection loading the same model with the same backend shares one net
+_net_registry = {}
+_registry_lock = threading.Lock()
+
+
+def shared_nets():
+    """{(weights, config, backend, target): SharedNet} of the nets loaded in this process"""
+    with _registry_lock:
+        return dict(_net_registry)
+
+
 class ObjectDetection:
     def __init__(self, weights_path, config_path):
         self.weights_path = weights_path
@@ -9,6 +49,17 @@ class ObjectDetection:
         self.classes = []
         self.colors = []
         self.output_layers = []
+        self.roi_mask = None
+        self.roi_rect = None
+        self._roi_cache = {}
+        self.target_class_ids = None
+        self.class_thresholds = {}
+        self.net_lock = threading.Lock()
+        # Startup metrics: seconds spent loading / warming up, and from creation to the first detect()
+        self.created = time.perf_counter()
+        self.load_time = 0.0
+        self.warmup_time = 0.0
+        self.time_to_first_frame = None
 
     def load_class_names(self, class_names_path):
         with open(class_names_path, 'r') as f:
@@ -18,65 +69,320 @@ class ObjectDetection:
         np.random.seed(42)
         self.colors = np.random.randint(0, 255, size=(len(self.classes), 3))
 
-    def load_detection_model(self, image_size=416, nmsThreshold=0.4, confThreshold=0.3):
-        self.net = cv2.dnn.readNet(self.weights_path, self.config_path)
-        self.net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
-        self.net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+    def load_detection_model(self, image_size=416, nmsThreshold=0.4, confThreshold=0.3,
+                             target_classes=None, class_thresholds=None,
+                             backend="opencv", target="cpu", num_threads=None, shared=True):
+        """
+        target_classes: class names or ids to keep (e.g. ["motorbike"]); None keeps every class
+        class_thresholds: {class name or id: confidence threshold} overriding confThreshold
+        Both are applied while decoding, before NMS
+        backend/target: names from DNN_BACKENDS / DNN_TARGETS ("openvino", "cpu_fp16", ...);
+        backend="auto" times every available CPU backend/target and keeps the fastest.
+        For INT8, load an INT8 OpenVINO IR (.xml/.bin) as weights/config with backend="openvino"
+        num_threads: cv2.setNumThreads() for the DNN and the rest of OpenCV
+        shared: reuse a net this process already loaded from the same files with the same
+        backend/target (forward passes are then serialised by a lock shared between streams)
+        """
+        if num_threads is not None:
+            cv2.setNumThreads(num_threads)
 
         self.image_size = image_size
         self.nmsThreshold = nmsThreshold
         self.confThreshold = confThreshold
+        self.set_class_filter(target_classes, class_thresholds)
+
+        if not shared:
+            self.load_net(backend, target)
+            return
+
+        key = (os.path.abspath(self.weights_path), os.path.abspath(self.config_path), backend, target)
+        # Held while loading so a second stream waits for the first load instead of repeating it
+        with _registry_lock:
+            entry = _net_registry.get(key)
+            if entry is None:
+                self.load_net(backend, target)
+                entry = _net_registry[key] = SharedNet(self.net, self.output_layers, self.backend, self.load_time)
+            else:
+                self.load_time = 0.0
+                print(f"Reusing loaded model {os.path.basename(self.weights_path)} ({entry.backend[0]}/{entry.backend[1]})")
+            entry.users += 1
+        self.net = entry.net
+        self.output_layers = entry.output_layers
+        self.backend = entry.backend
+        self.net_lock = entry.lock
+
+    def load_net(self, backend="opencv", target="cpu"):
+        start = time.perf_counter()
+        self.net = cv2.dnn.readNet(self.weights_path, self.config_path)
 
         # Get output layer names
         layer_names = self.net.getLayerNames()
         self.output_layers = [layer_names[i - 1] for i in self.net.getUnconnectedOutLayers()]
 
-    def detect(self, frame):
-        height, width, channels = frame.shape
+        if backend == "auto":
+            self.select_backend()
+        else:
+            self.set_backend(backend, target)
+        self.load_time = time.perf_counter() - start
+
+    def warmup(self, frame_size=None, runs=1):
+        """
+        Run `runs` forward passes on a blank frame of frame_size (width, height)
+        The first forward allocates buffers and initialises the backend; doing it
+        here keeps that cost out of the first real frame. The input matches what
+        detect() will use for frames of that size (ROI included). Skipped when the
+        size is unknown (0x0, as some cameras report before the first read)
+        """
+        width, height = frame_size or (self.image_size, self.image_size)
+        if width <= 0 or height <= 0:
+            print(f"Frame size {width}x{height} unknown, skipping warm-up")
+            return self.warmup_time
+        x, y, w, h, size = self.roi_geometry(width, height)
+        frame = np.zeros((h, w, 3), dtype=np.uint8)
+        start = time.perf_counter()
+        for _ in range(runs):
+            self.forward(frame, size)
+        self.warmup_time += time.perf_counter() - start
+        return self.warmup_time
+
+    def first_frame_done(self):
+        self.time_to_first_frame = time.perf_counter() - self.created
+        print(f"Time to first frame: {self.time_to_first_frame:.2f}s "
+              f"(model load {self.load_time:.2f}s, warm-up {self.warmup_time:.2f}s)")
+
+    def available_backends(self, targets=AUTO_TARGETS):
+        """(backend, target) name pairs this OpenCV build can run"""
+        pairs = []
+        for backend, backend_id in DNN_BACKENDS.items():
+            if backend == "default":
+                continue  # an alias of one of the others
+            try:
+                available = set(cv2.dnn.getAvailableTargets(backend_id))
+            except cv2.error:
+                continue
+            pairs += [(backend, target) for target in targets
+                      if target in DNN_TARGETS and DNN_TARGETS[target] in available]
+        return pairs
+
+    def set_backend(self, backend="opencv", target="cpu"):
+        if (backend, target) not in self.available_backends(DNN_TARGETS):
+            print(f"DNN backend {backend}/{target} is not available in this OpenCV build, using opencv/cpu")
+            backend, target = "opencv", "cpu"
+        self.net.setPreferableBackend(DNN_BACKENDS[backend])
+        self.net.setPreferableTarget(DNN_TARGETS[target])
+        self.backend = (backend, target)
+
+    def benchmark_backend(self, runs=3):
+        """Average ms of one forward at image_size, after a warm-up forward"""
+        frame = np.random.default_rng(0).integers(0, 256, (self.image_size, self.image_size, 3), dtype=np.uint8)
+        self.forward(frame)
+        start = time.perf_counter()
+        for _ in range(runs):
+            self.forward(frame)
+        return (time.perf_counter() - start) / runs * 1000
+
+    def select_backend(self, runs=3):
+        """Time every available CPU backend/target and keep the fastest"""
+        timings = {}
+        for backend, target in self.available_backends():
+            self.set_backend(backend, target)
+            try:
+                timings[(backend, target)] = self.benchmark_backend(runs)
+            except cv2.error as e:
+                # e.g. a layer the backend does not implement
+                print(f"  {backend}/{target}: failed ({str(e).strip().splitlines()[-1]})")
+                continue
+            print(f"  {backend}/{target}: {timings[(backend, target)]:.1f} ms/forward")
+
+        best = min(timings, key=timings.get) if timings else ("opencv", "cpu")
+        self.set_backend(*best)
+        latency = f"{timings[best]:.1f} ms/forward" if best in timings else "not measured"
+        print(f"DNN backend: {best[0]}/{best[1]} ({latency} at {self.image_size}x{self.image_size},"
+              f" {cv2.getNumThreads()} threads)")
+        return best
+
+    def class_id(self, name_or_id):
+        if isinstance(name_or_id, str):
+            if name_or_id not in self.classes:
+                raise ValueError(f"Unknown class '{name_or_id}', load_class_names() first")
+            return self.classes.index(name_or_id)
+        return int(name_or_id)
+
+    def set_class_filter(self, target_classes=None, class_thresholds=None):
+        """Keep only target_classes, with optional per-class confidence thresholds"""
+        if target_classes is None:
+            self.target_class_ids = None
+        elif len(target_classes) == 0:
+            raise ValueError("target_classes is empty: pass None to keep every class")
+        else:
+            self.target_class_ids = np.array(sorted({self.class_id(c) for c in target_classes}), dtype=np.int64)
+        self.class_thresholds = {self.class_id(c): t for c, t in (class_thresholds or {}).items()}
+
+    def score_threshold(self):
+        """Lowest confidence any kept class can pass with (used by NMS)"""
+        thresholds = [self.confThreshold]
+        if self.target_class_ids is not None:
+            thresholds = [self.class_thresholds.get(c, self.confThreshold) for c in self.target_class_ids.tolist()]
+        elif self.class_thresholds:
+            thresholds += list(self.class_thresholds.values())
+        return min(thresholds)
+
+    def set_roi(self, mask=None, rect=None):
+        """
+        Restrict inference to the bounding box of a mask or to a fixed rect (x, y, w, h)
+        Only that crop goes through the network, at an input size that keeps the
+        same pixels-per-input ratio as a full frame at image_size
+        """
+        self.roi_mask = mask
+        self.roi_rect = rect
+        self._roi_cache = {}
+
+    def roi_geometry(self, width, height):
+        """Return (x, y, w, h, (input_w, input_h)) of the region sent to the network"""
+        key = (width, height)
+        if key in self._roi_cache:
+            return self._roi_cache[key]
+
+        x, y, w, h = 0, 0, width, height
+        if self.roi_mask is not None:
+            mask = cv2.resize(self.roi_mask, (width, height), interpolation=cv2.INTER_NEAREST)
+            if mask.ndim == 3:
+                mask = cv2.cvtColor(mask, cv2.COLOR_BGR2GRAY)
+            # Ignore JPEG noise around the black area
+            points = cv2.findNonZero((mask > 127).astype(np.uint8))
+            if points is not None:
+                x, y, w, h = cv2.boundingRect(points)
+        elif self.roi_rect is not None:
+            rx, ry, rw, rh = self.roi_rect
+            x, y = max(0, int(rx)), max(0, int(ry))
+            w, h = min(width, int(rx + rw)) - x, min(height, int(ry + rh)) - y
+            if w <= 0 or h <= 0:
+                print(f"ROI rect {tuple(self.roi_rect)} is outside the {width}x{height} frame, using the full frame")
+                x, y, w, h = 0, 0, width, height
+
+        if (x, y, w, h) == (0, 0, width, height):
+            size = (self.image_size, self.image_size)
+        else:
+            # YOLO needs multiples of 32 on both sides
+            size = (max(32, int(np.ceil(w * self.image_size / width / 32)) * 32),
+                    max(32, int(np.ceil(h * self.image_size / height / 32)) * 32))
+            saved = 1 - (size[0] * size[1]) / (self.image_size * self.image_size)
+            print(f"ROI {w}x{h} at ({x}, {y}) -> network input {size[0]}x{size[1]}, "
+                  f"~{saved * 100:.0f}% fewer FLOPs per frame than {self.image_size}x{self.image_size}")
+
+        self._roi_cache[key] = (x, y, w, h, size)
+        return self._roi_cache[key]
+
+    def forward(self, frame, size=None):
+        """Run the network on one frame and return the raw output layers"""
+        if size is None:
+            size = (self.image_size, self.image_size)
 
         # Prepare blob
-        blob = cv2.dnn.blobFromImage(frame, 1/255.0, (self.image_size, self.image_size),
-                                      swapRB=True, crop=False)
-        self.net.setInput(blob)
+        blob = cv2.dnn.blobFromImage(frame, 1/255.0, size, swapRB=True, crop=False)
 
-        # Forward pass
-        outs = self.net.forward(self.output_layers)
+        # Forward pass (setInput + forward must not interleave with another stream on a shared net)
+        with self.net_lock:
+            self.net.setInput(blob)
+            return self.net.forward(self.output_layers)
 
-        class_ids = []
-        scores = []
-        boxes = []
+    def forward_batch(self, frames, size=None):
+        """Run the network once on a list of frames and return raw output layers per frame"""
+        if size is None:
+            size = (self.image_size, self.image_size)
 
-        for out in outs:
-            for detection in out:
-                scores_list = detection[5:]
-                class_id = np.argmax(scores_list)
-                confidence = scores_list[class_id]
+        blob = cv2.dnn.blobFromImages(frames, 1/255.0, size, swapRB=True, crop=False)
+        with self.net_lock:
+            self.net.setInput(blob)
+            outs = self.net.forward(self.output_layers)
 
-                if confidence > self.confThreshold:
-                    # Get box coordinates
-                    center_x = int(detection[0] * width)
-                    center_y = int(detection[1] * height)
-                    w = int(detection[2] * width)
-                    h = int(detection[3] * height)
+        # Region layers return (batch * rows, 5 + classes) or (batch, rows, 5 + classes)
+        # depending on the OpenCV version, both laid out batch-major
+        n = len(frames)
+        outs = [out.reshape(n, -1, out.shape[-1]) for out in outs]
+        return [[out[i] for out in outs] for i in range(n)]
 
-                    x = center_x - w // 2
-                    y = center_y - h // 2
+    def decode_outputs(self, outs, width, height, offset=(0, 0)):
+        """
+        Decode raw YOLO output layers into candidate boxes (before NMS)
+        All layers are stacked into one (rows, 5 + classes) array so thresholding,
+        argmax and box conversion run as whole-array operations
+        """
+        rows = np.concatenate([out.reshape(-1, out.shape[-1]) for out in outs])
+        if self.target_class_ids is not None:
+            # Cheap pre-filter: only rows where some target class could pass go through the full argmax
+            rows = rows[rows[:, 5 + self.target_class_ids].max(axis=1) > self.score_threshold()]
+        class_scores = rows[:, 5:]
+        class_ids = np.argmax(class_scores, axis=1)
+        confidences = class_scores[np.arange(len(rows)), class_ids]
 
-                    boxes.append([x, y, w, h])
-                    scores.append(float(confidence))
-                    class_ids.append(class_id)
+        if self.class_thresholds:
+            thresholds = np.full(class_scores.shape[1], self.confThreshold)
+            for class_id, threshold in self.class_thresholds.items():
+                thresholds[class_id] = threshold
+            keep = confidences > thresholds[class_ids]
+        else:
+            keep = confidences > self.confThreshold
+        if self.target_class_ids is not None:
+            # A row counts for its best class only, as if filtering after detect()
+            keep &= np.isin(class_ids, self.target_class_ids)
+        rows = rows[keep]
+        class_ids = class_ids[keep]
+        confidences = confidences[keep]
 
-        # Apply NMS
-        indices = cv2.dnn.NMSBoxes(boxes, scores, self.confThreshold, self.nmsThreshold)
+        # Same truncation as int() on each value, then floor division for the corner
+        center_x = (rows[:, 0] * width).astype(np.int64)
+        center_y = (rows[:, 1] * height).astype(np.int64)
+        w = (rows[:, 2] * width).astype(np.int64)
+        h = (rows[:, 3] * height).astype(np.int64)
+        boxes = np.stack([center_x - w // 2 + offset[0], center_y - h // 2 + offset[1], w, h], axis=1)
+
+        return (class_ids.tolist(), confidences.astype(float).tolist(), boxes.tolist())
+
+    def apply_nms(self, class_ids, scores, boxes):
+        """Apply NMS on decoded candidates and keep the surviving detections"""
+        indices = cv2.dnn.NMSBoxes(boxes, scores, self.score_threshold(), self.nmsThreshold)
 
         final_boxes = []
         final_scores = []
         final_class_ids = []
 
         if len(indices) > 0:
-            for i in indices.flatten():
+            for i in np.asarray(indices).flatten():
                 final_boxes.append(boxes[i])
                 final_scores.append(scores[i])
                 final_class_ids.append(class_ids[i])
 
         return (final_class_ids, final_scores, final_boxes)
+
+    def detect(self, frame):
+        height, width, channels = frame.shape
+        x, y, w, h, size = self.roi_geometry(width, height)
+
+        # Boxes of the crop are shifted back into full-frame coordinates
+        outs = self.forward(frame[y:y + h, x:x + w], size)
+        (class_ids, scores, boxes) = self.decode_outputs(outs, w, h, offset=(x, y))
+
+        # Apply NMS
+        detection = self.apply_nms(class_ids, scores, boxes)
+        if self.time_to_first_frame is None:
+            self.first_frame_done()
+        return detection
+
+    def detect_batch(self, frames):
+        """
+        Detect objects on several frames with a single forward pass
+        Returns one (class_ids, scores, boxes) tuple per frame, in input order
+        """
+        if not frames:
+            return []
+        regions = [self.roi_geometry(frame.shape[1], frame.shape[0]) for frame in frames]
+        crops = [frame[y:y + h, x:x + w] for frame, (x, y, w, h, _) in zip(frames, regions)]
+
+        results = []
+        for (x, y, w, h, _), outs in zip(regions, self.forward_batch(crops, regions[0][4])):
+            (class_ids, scores, boxes) = self.decode_outputs(outs, w, h, offset=(x, y))
+            results.append(self.apply_nms(class_ids, scores, boxes))
+        if self.time_to_first_frame is None:
+            self.first_frame_done()
+        return results
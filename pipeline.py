@@ -0,0 +1,198 @@
+import queue
+import threading
+import time
+
+from frame_mask import FrameMask
+
+_END = object()
+
+
+def read_batch(cap, size):
+    """Read up to size frames; fewer (or none) at the end of the video"""
+    frames = []
+    while len(frames) < size:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames.append(frame)
+    return frames
+
+
+class Pipeline:
+    """
+    Threaded decode -> infer -> track -> render pipeline
+    Each stage runs on its own thread and hands frames to the next one through a
+    bounded queue, so cap.read() and VideoWriter.write overlap with the DNN.
+    Every stage is a single thread reading a FIFO queue, so frames stay in order.
+    With batch_size > 1 the infer stage runs od.detect_batch on up to batch_size
+    queued frames at a time.
+
+    detect(frame_region) -> (class_ids, scores, boxes), defaults to od.detect
+    analyze(frame_idx, frame, tracks) -> info, grid/speed analytics on the tracker output
+    render(frame_idx, frame, detection, tracks, info), drawing and writing
+    """
+    STAGES = ("decode", "infer", "track", "render")
+
+    def __init__(self, cap, od, deep, mask=None, detect=None, analyze=None, render=None, queue_size=8,
+                 batch_size=1):
+        self.cap = cap
+        self.od = od
+        self.deep = deep
+        self.tracker = deep.tracker if deep.tracker is not None else deep.sort_tracker()
+        # Masked frames stay alive while queued for tracking: one buffer per queue slot,
+        # plus the batch held by the infer thread and the frames held by the track thread
+        self.frame_mask = FrameMask(mask, buffers=queue_size + batch_size + 2)
+        self.detect = detect if detect is not None else od.detect
+        if detect is None:
+            self.detect_batch = od.detect_batch
+        else:
+            self.detect_batch = lambda frame_regions: [detect(frame_region) for frame_region in frame_regions]
+        self.batch_size = max(1, batch_size)
+        self.analyze = analyze
+        self.render = render
+        self.queues = {
+            "decode->infer": queue.Queue(maxsize=queue_size),
+            "infer->track": queue.Queue(maxsize=queue_size),
+            "track->render": queue.Queue(maxsize=queue_size),
+        }
+        self.queue_size = queue_size
+        self.depth_samples = {name: [] for name in self.queues}
+        self.frames_done = 0
+        self._stop = threading.Event()
+        self._error = None
+
+    def _put(self, q, item):
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, q):
+        while not self._stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _END
+
+    def _run_stage(self, work):
+        try:
+            work()
+        except Exception as e:
+            self._error = e
+            self._stop.set()
+
+    def _decode(self):
+        out = self.queues["decode->infer"]
+        frame_idx = 0
+        while not self._stop.is_set():
+            ret, frame = self.cap.read()
+            if not ret:
+                break
+            frame_idx += 1
+            if not self._put(out, (frame_idx, frame)):
+                return
+        self._put(out, _END)
+
+    def _infer(self):
+        src, out = self.queues["decode->infer"], self.queues["infer->track"]
+        ended = False
+        while not ended:
+            batch = []
+            while len(batch) < self.batch_size:
+                item = self._get(src)
+                if item is _END:
+                    ended = True
+                    break
+                batch.append(item)
+            if not batch:
+                break
+
+            frame_regions = [self.frame_mask.apply(frame) for _, frame in batch]
+            if len(batch) == 1:
+                detections = [self.detect(frame_regions[0])]
+            else:
+                detections = self.detect_batch(frame_regions)
+            for (frame_idx, frame), frame_region, detection in zip(batch, frame_regions, detections):
+                if not self._put(out, (frame_idx, frame, frame_region, detection)):
+                    return
+        self._put(out, _END)
+
+    def _track(self):
+        src, out = self.queues["infer->track"], self.queues["track->render"]
+        while True:
+            item = self._get(src)
+            if item is _END:
+                break
+            frame_idx, frame, frame_region, detection = item
+            (class_ids, scores, boxes) = detection
+
+            features = self.deep.encoder(frame_region, boxes)
+            detections = self.deep.Detection(boxes, scores, class_ids, features)
+            self.tracker.predict()
+            tracks = self.tracker.update(detections)
+
+            info = self.analyze(frame_idx, frame, tracks) if self.analyze is not None else None
+            if not self._put(out, (frame_idx, frame, detection, tracks, info)):
+                return
+        self._put(out, _END)
+
+    def _render(self):
+        src = self.queues["track->render"]
+        while True:
+            item = self._get(src)
+            if item is _END:
+                break
+            if self.render is not None:
+                self.render(*item)
+            self.frames_done += 1
+        self._stop.set()
+
+    def depths(self):
+        """Current number of frames waiting in each queue"""
+        return {name: q.qsize() for name, q in self.queues.items()}
+
+    def report(self):
+        depths = self.depths()
+        return " | ".join(f"{name} {depth}/{self.queue_size}" for name, depth in depths.items())
+
+    def bottleneck(self):
+        """
+        Stage that limits throughput: frames pile up in the queue in front of the
+        slowest stage, so it is the consumer of the fullest queue on average
+        """
+        means = {name: sum(s) / len(s) for name, s in self.depth_samples.items() if s}
+        if not means:
+            return None
+        fullest = max(means, key=means.get)
+        return fullest.split("->")[1]
+
+    def run(self, report_every=5.0):
+        """Run until the video ends; prints queue depths every `report_every` seconds"""
+        workers = [threading.Thread(target=self._run_stage, args=(work,), name=name, daemon=True)
+                   for name, work in zip(self.STAGES, (self._decode, self._infer, self._track, self._render))]
+        for worker in workers:
+            worker.start()
+
+        start = time.perf_counter()
+        last_report = start
+        while not self._stop.wait(0.05):
+            for name, depth in self.depths().items():
+                self.depth_samples[name].append(depth)
+            now = time.perf_counter()
+            if report_every and now - last_report >= report_every:
+                last_report = now
+                print(f"  [pipeline] {self.frames_done} frames, {self.frames_done / (now - start):.1f} FPS | queues: {self.report()}")
+
+        for worker in workers:
+            worker.join()
+        if self._error is not None:
+            raise self._error
+
+        elapsed = time.perf_counter() - start
+        print(f"  [pipeline] {self.frames_done} frames in {elapsed:.1f}s ({self.frames_done / max(elapsed, 1e-9):.1f} FPS), "
+              f"bottleneck stage: {self.bottleneck()}")
+        return self.frames_done
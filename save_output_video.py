@@ -6,12 +6,30 @@ Processes video and saves results with detection boxes and tracking IDs
 import sys
 sys.path.insert(0, '/Users/hanjie/PycharmProjects/Motorbike-detection')
 
+import argparse
 import cv2
 import numpy as np
 import datetime
 from object_detection import ObjectDetection
 from deep_sort_wrapper import Deep
 from grid import RectangularArea, CheckTool
+from frame_mask import FrameMask
+from pipeline import Pipeline, read_batch
+
+parser = argparse.ArgumentParser(description="Process a.mp4 and save the annotated output video")
+parser.add_argument("--batch-size", type=int, default=1,
+                    help="frames per forward pass; larger batches trade latency for throughput")
+parser.add_argument("--threaded", action="store_true",
+                    help="run decode, inference, tracking and rendering on separate threads")
+parser.add_argument("--queue-size", type=int, default=8,
+                    help="frames buffered between pipeline stages in --threaded mode")
+parser.add_argument("--backend", default="opencv",
+                    help="DNN backend: opencv, openvino, or auto to time them and keep the fastest")
+parser.add_argument("--target", default="cpu",
+                    help="DNN target: cpu or cpu_fp16 (ignored with --backend auto)")
+parser.add_argument("--threads", type=int, default=None,
+                    help="OpenCV threads (default: OpenCV's own choice)")
+args = parser.parse_args()
 
 print("=" * 70)
 print("Motorbike Detection - Saving Output Video")
@@ -21,7 +39,9 @@ print("=" * 70)
 print("\n[1/5] Loading YOLOv4 model...")
 od = ObjectDetection("yolov4.weights", "yolov4.cfg")
 od.load_class_names("coco.names")
-od.load_detection_model(image_size=416, nmsThreshold=0.5, confThreshold=0.4)
+# Only motorcycles are decoded; other classes never reach NMS, tracking or drawing
+od.load_detection_model(image_size=416, nmsThreshold=0.5, confThreshold=0.4, target_classes=["motorbike"],
+                        backend=args.backend, target=args.target, num_threads=args.threads)
 print("✓ YOLOv4 model loaded")
 
 # Load Object Tracking Deep Sort
@@ -38,6 +58,8 @@ if mask is None:
     mask = None
 else:
     print(f"✓ Mask loaded: {mask.shape}")
+# One reusable output buffer per frame of a batch
+frame_mask = FrameMask(mask, buffers=args.batch_size)
 
 # Load video
 print("[4/5] Loading video...")
@@ -93,6 +115,16 @@ for r in range(n_rows):
 
 print(f"✓ Grid created: {len(grids)} cells")
 
+# Only run detection on the region covered by the mask (or the grid when there is no mask)
+if mask is not None:
+    od.set_roi(mask=mask)
+else:
+    od.set_roi(rect=(x_start, y_start, n_cols * cell_width, n_rows * cell_height))
+
+# First forward at the real input size now, not on the first frame
+od.warmup((width, height))
+print(f"✓ Model warmed up ({od.warmup_time * 1000:.0f} ms)")
+
 print("\n[5/5] Processing video...")
 print("=" * 70)
 
@@ -100,47 +132,7 @@ frame_idx = 0
 detection_count = 0
 tracking_count = 0
 
-while True:
-    ret, frame = cap.read()
-    if not ret:
-        break
-
-    frame_count += 1
-    frame_idx += 1
-    timestamp += datetime.timedelta(seconds=1/fps)
-
-    # Apply mask if available
-    if mask is not None:
-        mask_resized = cv2.resize(mask, (frame.shape[1], frame.shape[0]))
-        frame_region = cv2.bitwise_and(frame, mask_resized)
-    else:
-        frame_region = frame
-
-    # Object Detection
-    (class_ids, scores, boxes) = od.detect(frame_region)
-
-    # Filter only motorcycles (class_id = 3)
-    MOTORBIKE_CLASS_ID = 3
-    filtered_boxes = []
-    filtered_scores = []
-    filtered_class_ids = []
-
-    for class_id, score, box in zip(class_ids, scores, boxes):
-        if class_id == MOTORBIKE_CLASS_ID:
-            filtered_boxes.append(box)
-            filtered_scores.append(score)
-            filtered_class_ids.append(class_id)
-
-    detection_count += len(filtered_boxes)
-
-    # Object Tracking
-    features = deep.encoder(frame_region, filtered_boxes)
-    detections = deep.Detection(filtered_boxes, filtered_scores, filtered_class_ids, features)
-
-    tracker.predict()
-    (tracked_class_ids, object_ids, tracked_boxes) = tracker.update(detections)
-    tracking_count += len(object_ids)
-
+def draw_output(frame, frame_idx, n_detections, tracked_class_ids, object_ids, tracked_boxes):
     # Draw detections and tracking on frame
     output_frame = frame.copy()
 
@@ -170,18 +162,64 @@ while True:
     # Draw statistics
     cv2.putText(output_frame, f"Frame: {frame_idx}/{total_frames}", (10, 30),
                cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
-    cv2.putText(output_frame, f"Detections: {len(boxes)}", (10, 60),
+    cv2.putText(output_frame, f"Detections: {n_detections}", (10, 60),
                cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
     cv2.putText(output_frame, f"Tracked IDs: {len(object_ids)}", (10, 90),
                cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
+    return output_frame
 
-    # Write frame to output video
-    out.write(output_frame)
-
-    # Print progress
+def print_progress(frame_idx, n_detections, n_tracked):
     if frame_idx % 5 == 0 or frame_idx == total_frames:
         progress = (frame_idx / total_frames) * 100
-        print(f"  Progress: {progress:5.1f}% | Frame {frame_idx}/{total_frames} | Detections: {len(boxes)} | Tracked: {len(object_ids)}")
+        print(f"  Progress: {progress:5.1f}% | Frame {frame_idx}/{total_frames} | Detections: {n_detections} | Tracked: {n_tracked}")
+
+if args.threaded:
+    # Decode, inference, tracking and rendering/encoding overlap on separate threads
+    def render(idx, frame, detection, tracks, info):
+        global frame_idx, detection_count, tracking_count
+        (tracked_class_ids, object_ids, tracked_boxes) = tracks
+        frame_idx = idx
+        detection_count += len(detection[2])
+        tracking_count += len(object_ids)
+
+        out.write(draw_output(frame, frame_idx, len(detection[2]), tracked_class_ids, object_ids, tracked_boxes))
+        print_progress(frame_idx, len(detection[2]), len(object_ids))
+
+    pipeline = Pipeline(cap, od, deep, mask=mask,
+                        render=render, queue_size=args.queue_size, batch_size=args.batch_size)
+    pipeline.run()
+else:
+    while True:
+        frames = read_batch(cap, args.batch_size)
+        if not frames:
+            break
+
+        # Apply mask if available (resized once, written into reused buffers)
+        frame_regions = [frame_mask.apply(frame) for frame in frames]
+
+        # Object Detection (one forward pass for the whole batch)
+        batch_results = od.detect_batch(frame_regions)
+
+        for frame, frame_region, (class_ids, scores, boxes) in zip(frames, frame_regions, batch_results):
+            frame_count += 1
+            frame_idx += 1
+            timestamp += datetime.timedelta(seconds=1/fps)
+
+            detection_count += len(boxes)
+
+            # Object Tracking
+            features = deep.encoder(frame_region, boxes)
+            detections = deep.Detection(boxes, scores, class_ids, features)
+
+            tracker.predict()
+            (tracked_class_ids, object_ids, tracked_boxes) = tracker.update(detections)
+            tracking_count += len(object_ids)
+
+            # Write frame to output video
+            out.write(draw_output(frame, frame_idx, len(boxes), tracked_class_ids, object_ids, tracked_boxes))
+
+            # Print progress
+            print_progress(frame_idx, len(boxes), len(object_ids))
 
 cap.release()
 out.release()
@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+"""
+Motorbike Detection Project - Segment-parallel offline processing
+Splits one long recording into frame ranges and runs detection + tracking on
+the ranges in parallel worker processes. Every segment starts `--warmup`
+frames early so its tracker has settled (tracks confirmed, Kalman state
+converged) by the time its own range begins. Track IDs are then joined
+across segment boundaries by box IoU over the overlap, and the grid speed
+analytics are replayed once, sequentially, on the joined tracks.
+
+After warm-up both trackers follow the same boxes, so the only difference
+from a sequential run is the tracker state carried over the boundary: a
+vehicle crossing a boundary may enter a cell a frame or two earlier or later.
+How much that moves the speeds depends on the video; pass --verify to run the
+whole file sequentially as well, pair the records and report the measured
+speed deviation (the exit status is non-zero when a record is unpaired or
+deviates by more than --tolerance).
+
+  python3 segment_video.py a.mp4 --segments 8 --warmup 60
+"""
+import argparse
+import multiprocessing as mp
+import os
+import sys
+import time
+
+import numpy as np
+
+from multi_camera import DEFAULT_GRID, DEFAULT_MODEL, DEFAULT_TRACKER
+
+# Observation columns: frame, track id, class id, x1, y1, x2, y2
+FRAME, TRACK, CLASS = 0, 1, 2
+
+SPEED_TOLERANCE = 0.05
+FRAME_TOLERANCE = 2
+
+
+def track_range(source, start, stop, model, tracker_params, mask_path, threads):
+    """Detect and track frames [start, stop) of a video; returns an (n, 7) observation array"""
+    import cv2
+    from object_detection import ObjectDetection
+    from deep_sort_wrapper import Deep
+    from grid import GridLayout
+    from frame_mask import FrameMask
+
+    od = ObjectDetection(model["weights"], model["config"])
+    od.load_class_names(model["classes"])
+    od.load_detection_model(image_size=model["image_size"],
+                            nmsThreshold=model["nmsThreshold"],
+                            confThreshold=model["confThreshold"],
+                            target_classes=model["target_classes"],
+                            class_thresholds=model["class_thresholds"],
+                            backend=model["backend"],
+                            target=model["target"],
+                            num_threads=threads)
+    deep = Deep(**tracker_params)
+    tracker = deep.sort_tracker()
+
+    mask = cv2.imread(mask_path) if mask_path else None
+    frame_mask = FrameMask(mask)
+    if mask is not None:
+        od.set_roi(mask=mask)
+    else:
+        od.set_roi(rect=GridLayout(**DEFAULT_GRID).extent())
+
+    cap = cv2.VideoCapture(source)
+    seek_to_frame(cv2, cap, source, start)
+
+    observations = []
+    for frame_idx in range(start, stop):
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frame_region = frame_mask.apply(frame)
+        (class_ids, scores, boxes) = od.detect(frame_region)
+
+        features = deep.encoder(frame_region, boxes)
+        detections = deep.Detection(boxes, scores, class_ids, features)
+        tracker.predict()
+        (class_ids, object_ids, boxes) = tracker.update(detections)
+
+        for class_id, object_id, box in zip(class_ids, object_ids, boxes):
+            observations.append([frame_idx, object_id, class_id, *box])
+    cap.release()
+
+    return np.array(observations, dtype=np.int64).reshape(-1, 7)
+
+
+def seek_to_frame(cv2, cap, source, start):
+    """
+    Position cap on frame `start` exactly
+    Seeking compressed video lands on a nearby keyframe on some backends, so the
+    reported position is checked and, if it is off, the video is read up to start
+    """
+    if start == 0:
+        return cap
+    if cap.set(cv2.CAP_PROP_POS_FRAMES, start) and int(cap.get(cv2.CAP_PROP_POS_FRAMES)) == start:
+        return cap
+    cap.open(source)
+    for _ in range(start):
+        if not cap.grab():
+            break
+    return cap
+
+
+def box_iou(a, b):
+    """IoU of matching rows of two (n, 4) xyxy arrays"""
+    x1 = np.maximum(a[:, 0], b[:, 0])
+    y1 = np.maximum(a[:, 1], b[:, 1])
+    x2 = np.minimum(a[:, 2], b[:, 2])
+    y2 = np.minimum(a[:, 3], b[:, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / np.maximum(area_a + area_b - inter, 1)
+
+
+def match_tracks(previous, current, min_iou=0.5, min_frames=3):
+    """
+    Map track ids of `current` to ids of `previous` using the frames both cover
+    A pair scores the mean IoU of its boxes over their common frames; pairs are
+    accepted greedily from the best score down, each id used at most once
+    """
+    scores = []
+    for prev_id in np.unique(previous[:, TRACK]):
+        prev = previous[previous[:, TRACK] == prev_id]
+        prev_boxes = {row[FRAME]: row[3:] for row in prev}
+        for cur_id in np.unique(current[:, TRACK]):
+            cur = current[current[:, TRACK] == cur_id]
+            common = [row for row in cur if row[FRAME] in prev_boxes]
+            if len(common) < min_frames:
+                continue
+            cur_boxes = np.array([row[3:] for row in common])
+            prev_common = np.array([prev_boxes[row[FRAME]] for row in common])
+            iou = box_iou(cur_boxes, prev_common).mean()
+            if iou >= min_iou:
+                scores.append((iou, prev_id, cur_id))
+
+    mapping = {}
+    used = set()
+    for iou, prev_id, cur_id in sorted(scores, reverse=True):
+        if prev_id in used or cur_id in mapping:
+            continue
+        mapping[cur_id] = prev_id
+        used.add(prev_id)
+    return mapping
+
+
+def join_segments(segments, warmup):
+    """
+    Join per-segment observations into one track-id space
+    segments: list of (start, stop, observations) where observations cover [start - warmup, stop)
+    """
+    joined = []
+    next_id = 1
+    previous = None
+    for start, stop, obs in segments:
+        overlap = obs[obs[:, FRAME] < start]
+        own = obs[obs[:, FRAME] >= start]
+
+        mapping = {}
+        if previous is not None and len(overlap):
+            prev_overlap = previous[previous[:, FRAME] >= start - warmup]
+            mapping = match_tracks(prev_overlap, overlap)
+
+        global_ids = {}
+        for local_id in np.unique(own[:, TRACK]):
+            if local_id in mapping:
+                global_ids[local_id] = mapping[local_id]
+            else:
+                global_ids[local_id] = next_id
+                next_id += 1
+
+        own = own.copy()
+        own[:, TRACK] = [global_ids[i] for i in own[:, TRACK]]
+        joined.append(own)
+        previous = own
+    return np.concatenate(joined) if joined else np.zeros((0, 7), dtype=np.int64)
+
+
+def replay_grid(observations, classes, fps, grid_params, target_classes=("motorbike",)):
+    """Run the grid speed analytics over joined tracks (of target_classes), frame by frame"""
+    from grid import GridLayout
+
+    grid_layout = GridLayout(keep_records=True, fps=fps, **grid_params)
+    observations = observations[np.argsort(observations[:, FRAME], kind="stable")]
+    target_ids = np.array([classes.index(name) for name in target_classes])
+    observations = observations[np.isin(observations[:, CLASS], target_ids)]
+
+    for frame_idx, object_id, class_id, x, y, x2, y2 in observations:
+        grid_layout.update(int(object_id), int((x + x2) / 2), int((y + y2) / 2), int(frame_idx) + 1)
+    return grid_layout.pop_records()
+
+
+def compare_records(sequential, parallel):
+    """
+    Pair records by lane and exit frame (within FRAME_TOLERANCE)
+    Returns (pairs, unpaired sequential records, unpaired parallel records), where
+    pairs holds (sequential record, relative spatial speed deviation of its parallel
+    record; None when either has no spatial speed)
+    """
+    pairs, missing = [], []
+    unused = list(parallel)
+    for record in sequential:
+        candidates = [r for r in unused if r["lane"] == record["lane"]
+                      and abs(r["exit_frame"] - record["exit_frame"]) <= FRAME_TOLERANCE]
+        if not candidates:
+            missing.append(record)
+            continue
+        best = min(candidates, key=lambda r: abs(r["exit_frame"] - record["exit_frame"]))
+        unused.remove(best)
+        speed, other = record["spatial_speed"], best["spatial_speed"]
+        deviation = abs(other - speed) / abs(speed) if speed and other else None
+        pairs.append((record, deviation))
+    return pairs, missing, unused
+
+
+def main():
+    import cv2
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("source", nargs="?", default="a.mp4")
+    parser.add_argument("--mask", default="new_mask.jpeg")
+    parser.add_argument("--segments", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--warmup", type=int, default=60, help="frames each segment starts early")
+    parser.add_argument("--verify", action="store_true", help="also run sequentially and compare speed records")
+    parser.add_argument("--tolerance", type=float, default=SPEED_TOLERANCE,
+                        help="largest relative spatial speed deviation --verify accepts")
+    args = parser.parse_args()
+
+    cap = cv2.VideoCapture(args.source)
+    if not cap.isOpened():
+        print(f"✗ Cannot open {args.source}")
+        return 1
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30
+    cap.release()
+
+    mask_path = args.mask if os.path.exists(args.mask) else None
+    bounds = np.linspace(0, total_frames, args.segments + 1).astype(int)
+    ranges = [(int(a), int(b)) for a, b in zip(bounds[:-1], bounds[1:]) if b > a]
+    threads = max(1, (os.cpu_count() or 1) // len(ranges))
+
+    print("=" * 70)
+    print(f"Segment-parallel run: {total_frames} frames, {len(ranges)} segments, warm-up {args.warmup} frames")
+    print("=" * 70)
+
+    with open(DEFAULT_MODEL["classes"], 'r') as f:
+        classes = [line.strip() for line in f.readlines()]
+
+    ctx = mp.get_context("spawn")
+    start = time.perf_counter()
+    jobs = [(args.source, max(0, a - args.warmup), b, DEFAULT_MODEL, DEFAULT_TRACKER, mask_path, threads)
+            for a, b in ranges]
+    with ctx.Pool(processes=len(ranges)) as pool:
+        results = pool.starmap(track_range, jobs)
+    observations = join_segments([(a, b, obs) for (a, b), obs in zip(ranges, results)], args.warmup)
+    records = replay_grid(observations, classes, fps, DEFAULT_GRID, DEFAULT_MODEL["target_classes"])
+    elapsed = time.perf_counter() - start
+    print(f"✓ Parallel: {len(records)} speed records in {elapsed:.1f}s ({total_frames / max(elapsed, 1e-9):.1f} FPS)")
+
+    if args.verify:
+        start = time.perf_counter()
+        sequential_obs = track_range(args.source, 0, total_frames, DEFAULT_MODEL, DEFAULT_TRACKER,
+                                     mask_path, os.cpu_count() or 1)
+        sequential = replay_grid(sequential_obs, classes, fps, DEFAULT_GRID, DEFAULT_MODEL["target_classes"])
+        elapsed = time.perf_counter() - start
+        print(f"✓ Sequential: {len(sequential)} speed records in {elapsed:.1f}s")
+        if not sequential:
+            print("✗ The sequential run produced no speed records, nothing to verify")
+            return 1
+
+        pairs, missing, extra = compare_records(sequential, records)
+        deviations = np.array([d for _, d in pairs if d is not None])
+        print(f"  Paired (same lane, exit within ±{FRAME_TOLERANCE} frames): {len(pairs)}/{len(sequential)}")
+        if len(deviations):
+            print(f"  Spatial speed deviation: mean {deviations.mean() * 100:.2f}%, "
+                  f"p95 {np.percentile(deviations, 95) * 100:.2f}%, max {deviations.max() * 100:.2f}%")
+        over = [record for record, d in pairs if d is not None and d > args.tolerance]
+        for record in over:
+            print(f"  ✗ spatial speed off by more than {args.tolerance * 100:.0f}%: sequential record {record}")
+        for record in missing:
+            print(f"  ✗ no parallel match for sequential record {record}")
+        for record in extra:
+            print(f"  ✗ parallel-only record {record}")
+        return 1 if over or missing or extra else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,161 @@
+import datetime
+import json
+import os
+import sqlite3
+
+import pandas as pd
+
+# One row per vehicle that reached an end cell (see GridLayout.make_record)
+RECORD_FIELDS = ("id", "lane", "entry_frame", "entry_time", "exit_frame", "exit_time",
+                 "instant_speed", "spatial_speed", "path")
+
+
+def make_parent(path):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+
+class Sink:
+    """
+    Batched writer for per-vehicle records (dicts with `fields` as keys)
+    write() only appends to an in-memory buffer; the buffer goes to storage
+    once it holds batch_size records, on flush() and on close()
+    """
+    def __init__(self, fields=RECORD_FIELDS, batch_size=1000):
+        self.fields = tuple(fields)
+        self.batch_size = batch_size
+        self.buffer = []
+        self.written = 0
+
+    def write(self, record):
+        self.buffer.append(record)
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+    def write_many(self, records):
+        for record in records:
+            self.write(record)
+
+    def flush(self):
+        if self.buffer:
+            self.write_batch(self.buffer)
+            self.written += len(self.buffer)
+            self.buffer = []
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write_batch(self, records):
+        raise NotImplementedError
+
+
+class RollingFileSink(Sink):
+    """
+    Buffers records in a pandas DataFrame batch and appends it to CSV or Parquet files
+    A new file ({prefix}_0000.csv, {prefix}_0001.csv, ...) is started once the
+    current one holds rows_per_file rows; batches are split at that limit, so no
+    file holds more. Parquet needs pyarrow; every batch (or part of one) is one
+    row group and the cell path is stored as a list column
+    """
+    def __init__(self, prefix, format="csv", rows_per_file=100000, fields=RECORD_FIELDS, batch_size=1000):
+        super().__init__(fields, batch_size)
+        if format not in ("csv", "parquet"):
+            raise ValueError(f"Unknown file format '{format}', use 'csv' or 'parquet'")
+        if format == "parquet":
+            import pyarrow  # noqa: F401  fail at start-up rather than at the first flush
+        self.prefix = prefix
+        self.format = format
+        self.rows_per_file = rows_per_file
+        self.file_index = -1
+        self.rows_in_file = 0
+        self.parquet_writer = None
+        self.paths = []
+
+    def next_file(self):
+        self.close_file()
+        self.file_index += 1
+        self.rows_in_file = 0
+        self.paths.append(f"{self.prefix}_{self.file_index:04d}.{self.format}")
+        make_parent(self.paths[-1])
+
+    def close_file(self):
+        if self.parquet_writer is not None:
+            self.parquet_writer.close()
+            self.parquet_writer = None
+
+    def write_batch(self, records):
+        while records:
+            if self.file_index < 0 or self.rows_in_file >= self.rows_per_file:
+                self.next_file()
+            room = self.rows_per_file - self.rows_in_file
+            self.write_file(records[:room])
+            records = records[room:]
+
+    def write_file(self, records):
+        frame = pd.DataFrame.from_records(records, columns=list(self.fields))
+        path = self.paths[-1]
+
+        if self.format == "csv":
+            if "path" in frame:
+                frame["path"] = frame["path"].map(json.dumps)
+            frame.to_csv(path, mode="a", header=self.rows_in_file == 0, index=False)
+        else:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            table = pa.Table.from_pandas(frame, preserve_index=False)
+            if self.parquet_writer is None:
+                self.parquet_writer = pq.ParquetWriter(path, table.schema)
+            self.parquet_writer.write_table(table.cast(self.parquet_writer.schema))
+        self.rows_in_file += len(frame)
+
+    def close(self):
+        super().close()
+        self.close_file()
+
+
+class SQLiteSink(Sink):
+    """Appends records to a SQLite table, one executemany + commit per batch"""
+    def __init__(self, path, table="vehicle_records", fields=RECORD_FIELDS, batch_size=500):
+        super().__init__(fields, batch_size)
+        self.table = table
+        make_parent(path)
+        self.conn = sqlite3.connect(path)
+        columns = ", ".join(f'"{field}"' for field in self.fields)
+        self.conn.execute(f'CREATE TABLE IF NOT EXISTS "{table}" ({columns})')
+        self.insert = f'INSERT INTO "{table}" ({columns}) VALUES ({", ".join("?" * len(self.fields))})'
+
+    @staticmethod
+    def column_value(value):
+        if isinstance(value, (list, tuple, dict)):
+            return json.dumps(value)
+        if isinstance(value, (datetime.datetime, datetime.date)):
+            return value.isoformat()
+        return value
+
+    def write_batch(self, records):
+        rows = [tuple(self.column_value(record.get(field)) for field in self.fields) for record in records]
+        with self.conn:
+            self.conn.executemany(self.insert, rows)
+
+    def close(self):
+        super().close()
+        self.conn.close()
+
+
+def open_sink(path, fields=RECORD_FIELDS, **kwargs):
+    """Sink chosen by extension: .csv / .parquet (rolling files named after path) or .db / .sqlite"""
+    stem, ext = os.path.splitext(path)
+    ext = ext.lower()
+    if ext in (".csv", ".parquet"):
+        return RollingFileSink(stem, format=ext[1:], fields=fields, **kwargs)
+    if ext in (".db", ".sqlite", ".sqlite3"):
+        return SQLiteSink(path, fields=fields, **kwargs)
+    raise ValueError(f"No sink for '{path}': use a .csv, .parquet or .db file")
@@ -0,0 +1,140 @@
+import cv2
+import numpy as np
+
+
+class ZoneMap:
+    """
+    Polygon zones rasterized once into a uint8 label image of the stream size
+    label[y, x] is the index of the polygon containing pixel (x, y), or NONE.
+    A pixel on a polygon edge is in no zone and where polygons overlap the first
+    one in the list wins, as with cv2.pointPolygonTest(p, pt, False) > 0. That is
+    exact for axis-aligned polygons; on slanted edges the rasterized outline may
+    differ from pointPolygonTest by one pixel
+    """
+    NONE = 255
+
+    def __init__(self, polygons, width, height):
+        if len(polygons) >= self.NONE:
+            raise ValueError(f"At most {self.NONE - 1} zones fit in a uint8 label map, got {len(polygons)}")
+        self.polygons = [np.asarray(p, dtype=np.int32).reshape(-1, 1, 2) for p in polygons]
+        self.width = int(width)
+        self.height = int(height)
+        self.label = np.full((self.height, self.width), self.NONE, dtype=np.uint8)
+
+        # Paint the last polygon first so earlier polygons overwrite it on overlap
+        inside = np.zeros_like(self.label)
+        for idx in reversed(range(len(self.polygons))):
+            inside[:] = 0
+            cv2.fillPoly(inside, [self.polygons[idx]], 1)
+            cv2.polylines(inside, [self.polygons[idx]], True, 0, 1)
+            self.label[inside == 1] = idx
+
+    def lookup(self, x, y):
+        """Zone index of point (x, y), -1 if it is in no zone or outside the frame"""
+        x, y = int(x), int(y)
+        if not (0 <= x < self.width and 0 <= y < self.height):
+            return -1
+        idx = self.label[y, x]
+        return -1 if idx == self.NONE else int(idx)
+
+    def lookup_many(self, points):
+        """Zone index of every (x, y) row of points as an int array, -1 where lookup() gives -1"""
+        points = np.asarray(points, dtype=np.int64).reshape(-1, 2)
+        xs, ys = points[:, 0], points[:, 1]
+        valid = (xs >= 0) & (xs < self.width) & (ys >= 0) & (ys < self.height)
+        zones = np.full(len(points), -1, dtype=np.int64)
+        idx = self.label[ys[valid], xs[valid]].astype(np.int64)
+        zones[valid] = np.where(idx == self.NONE, -1, idx)
+        return zones
+
+
+class ZoneStateMachine:
+    """
+    Per-track progress through the zones of one-way lanes, e.g. lanes=[(0, 1, 2), (3, 4, 5)]
+    A track has to enter the zones of a lane in order: entering the second zone
+    starts the timing and entering the last one completes the trip. A track first
+    seen in any other zone is going the wrong way (or was picked up late); it is
+    dropped, like a track that leaves its lane's order, as soon as it enters a
+    different zone, and starts over from the zone it is in at its next step.
+    Transitions come from a (state x zone) table built once, so a step is O(1)
+    """
+    UNTRACKED = 0
+    DROP = -1
+
+    def __init__(self, lanes, n_zones=None):
+        self.lanes = [tuple(lane) for lane in lanes]
+        if n_zones is None:
+            n_zones = max(max(lane) for lane in self.lanes) + 1
+        self.n_zones = n_zones
+
+        # State ids: 0 untracked, then (lane, position) for every lane zone, then wrong-way in zone z
+        self.state_lane = [None]
+        self.state_pos = [None]
+        lane_state = {}
+        for lane_idx, lane in enumerate(self.lanes):
+            for pos in range(len(lane)):
+                lane_state[lane_idx, pos] = len(self.state_lane)
+                self.state_lane.append(lane_idx)
+                self.state_pos.append(pos)
+        wrong_way = {}
+        for zone in range(n_zones):
+            wrong_way[zone] = len(self.state_lane)
+            self.state_lane.append(None)
+            self.state_pos.append(zone)
+        lane_start = {lane[0]: lane_idx for lane_idx, lane in enumerate(self.lanes)}
+
+        table = [[lane_state[lane_start[zone], 0] if zone in lane_start else wrong_way[zone]
+                  for zone in range(n_zones)]]
+        for (lane_idx, pos), state in lane_state.items():
+            lane = self.lanes[lane_idx]
+            row = [state if zone in lane[:pos + 1] else self.DROP for zone in range(n_zones)]
+            if pos + 1 < len(lane):
+                row[lane[pos + 1]] = lane_state[lane_idx, pos + 1]
+            table.append(row)
+        for zone, state in wrong_way.items():
+            table.append([state if other == zone else self.DROP for other in range(n_zones)])
+        self.table = tuple(tuple(row) for row in table)
+
+        self.states = {}  # object_id -> state id
+        self.started = {}  # object_id -> (frame, time) of entering the second zone of its lane
+        self.completed = 0
+        self.dropped = 0
+
+    def step(self, object_id, zone, frame, timestamp=None):
+        """
+        Move object_id into zone (-1: in no zone, nothing changes)
+        Returns (lane index, start frame, start time) when this step completes a trip, else None
+        """
+        if zone < 0:
+            return None
+        state = self.states.get(object_id, self.UNTRACKED)
+        new_state = self.table[state][zone]
+        if new_state == state:
+            return None
+        if new_state == self.DROP:
+            self.evict(object_id)
+            self.dropped += 1
+            return None
+
+        self.states[object_id] = new_state
+        lane_idx = self.state_lane[new_state]
+        if lane_idx is None or state == self.UNTRACKED:
+            return None
+        pos = self.state_pos[new_state]
+        if pos == 1:
+            self.started[object_id] = (frame, timestamp)
+        if pos == len(self.lanes[lane_idx]) - 1:
+            self.completed += 1
+            start_frame, start_time = self.started[object_id]
+            return lane_idx, start_frame, start_time
+        return None
+
+    def evict(self, object_id):
+        self.states.pop(object_id, None)
+        self.started.pop(object_id, None)
+
+    def stats(self):
+        return {"tracked": len(self.states), "completed": self.completed, "dropped": self.dropped}
+
+    def report(self):
+        return f"zones: {len(self.states)} tracked | {self.completed} trips | {self.dropped} dropped"